@@ -1,61 +1,282 @@
+import time
+import math
+import heapq
 import astar
+import grid
 import message
+import search_map
+import utilities
+
+class ARASolution:
+    def __init__(self, path, epsilon, bound, run_time, expanded):
+        self.path = path
+        # Epsilon used for the iteration and the suboptimality bound proven for the path
+        self.epsilon = epsilon
+        self.bound = bound
+        # Milliseconds since the search started
+        self.run_time = run_time
+        self.expanded = expanded
+
+
+class ARASearch:
+    # Anytime Repairing A* (Likhachev et al.): g values, OPEN, INCONS and CLOSED are
+    # kept between iterations, so lowering epsilon only repairs the previous search
+
+    # Number of expansions between two deadline checks
+    CHECK_EVERY = 256
+
+    def __init__(self, map, heuristic, epsilon=3.0, delta_epsilon=0.5, message_queue=None):
+        self.map = map
+        self.heuristic = heuristic
+        self.epsilon = max(epsilon, 1.0)
+        self.delta_epsilon = delta_epsilon
+        self.message_queue = message.EventQueue.wrap(message_queue, map.width)
+
+        self.g_values = map.new_buffer(-1)
+        # Heuristic values are cached per block, or taken from a precomputed field
+        self.h_values = None
+        if hasattr(heuristic, "lookup"):
+            self.h_values = heuristic.lookup(map, map.end)
+        if self.h_values == None:
+            self.h_values = map.new_buffer(-1)
+        self.parents = map.new_buffer(-1)
+        # A block is closed when its stamp equals the current iteration
+        self.closed = map.new_buffer(0)
+        self.iteration = 1
+        self.in_open = bytearray(len(map.cells))
+        self.in_incons = bytearray(len(map.cells))
+        self.open = []
+        self.incons = []
+        self.expanded = 0
+        self.pushes = 0
+        self.peak_open = 0
+        self.timed_out = False
+        self.probe = search_map.Position()
+
+        self.start_cell = map.cell_id(map.start.x, map.start.y)
+        self.end_cell = map.cell_id(map.end.x, map.end.y)
+        if not map.is_valid(map.end.x, map.end.y):
+            self.end_cell = -1
+        if map.is_valid(map.start.x, map.start.y) and not map.is_wall(map.start.x, map.start.y):
+            self.g_values[self.start_cell] = 0
+            self.push(self.start_cell)
+
+    def h(self, cell):
+        h_value = self.h_values[cell]
+        if h_value == -1:
+            width = self.map.width
+            self.probe.x = cell // width - 1
+            self.probe.y = cell % width - 1
+            h_value = self.heuristic(self.probe, self.map.end)
+            self.h_values[cell] = h_value
+        return h_value
+
+    def push(self, cell):
+        g_value = self.g_values[cell]
+        heapq.heappush(self.open, (g_value + self.h(cell) * self.epsilon, -g_value, cell))
+        self.in_open[cell] = 1
+        self.pushes += 1
+        if len(self.open) > self.peak_open:
+            self.peak_open = len(self.open)
+
+    def goal_g(self):
+        if self.end_cell == -1 or self.g_values[self.end_cell] == -1:
+            return -1
+        return self.g_values[self.end_cell]
+
+    def min_open_f(self):
+        # Drop stale entries from the top of the heap
+        queue = self.open
+        while queue:
+            _, g_key, cell = queue[0]
+            if self.in_open[cell] and -g_key == self.g_values[cell]:
+                return queue[0][0]
+            heapq.heappop(queue)
+        return None
+
+    def improve_path(self, deadline=None):
+        # Returns False when the deadline (a time.perf_counter() value) is reached first
+        cells = self.map.cells
+        width = self.map.width
+        offsets = self.map.neighbor_offsets()
+        wall = search_map.Map.WALL
+        g_values = self.g_values
+        parents = self.parents
+        closed = self.closed
+        in_open = self.in_open
+        iteration = self.iteration
+        message_queue = self.message_queue
+        check_every = ARASearch.CHECK_EVERY
+
+        while True:
+            min_f = self.min_open_f()
+            if min_f == None:
+                break
+            goal_g = self.goal_g()
+            if goal_g != -1 and goal_g <= min_f:
+                break
+            if deadline != None and self.expanded % check_every == 0 and time.perf_counter() >= deadline:
+                self.timed_out = True
+                return False
+
+            cell = heapq.heappop(self.open)[2]
+            in_open[cell] = 0
+            closed[cell] = iteration
+            self.expanded += 1
+
+            # Request drawing
+            if message_queue != None:
+                message_queue.push(cell, grid.Grid.POP_ID)
+
+            g_value = g_values[cell] + 1
+            for offset in offsets:
+                child = cell + offset
+                if cells[child] == wall:
+                    continue
+                child_g = g_values[child]
+                if child_g != -1 and child_g <= g_value:
+                    continue
+
+                g_values[child] = g_value
+                parents[child] = cell
+                # Closed blocks wait in INCONS for the next iteration
+                if closed[child] == iteration:
+                    if not self.in_incons[child]:
+                        self.in_incons[child] = 1
+                        self.incons.append(child)
+                    continue
+                self.push(child)
+
+                # Request drawing
+                if message_queue != None:
+                    message_queue.push(child, grid.Grid.IN_QUEUE_ID)
+        return True
+
+    def bound(self):
+        # epsilon' = min(epsilon, g(goal) / min over OPEN and INCONS of g + h)
+        goal_g = self.goal_g()
+        if goal_g == -1:
+            return self.epsilon
+        lower = goal_g
+        for _, g_key, cell in self.open:
+            if self.in_open[cell] and -g_key == self.g_values[cell]:
+                lower = min(lower, self.g_values[cell] + self.h(cell))
+        for cell in self.incons:
+            lower = min(lower, self.g_values[cell] + self.h(cell))
+        if lower <= 0:
+            return 1.0
+        return max(1.0, min(self.epsilon, goal_g / lower))
+
+    def decrease_epsilon(self, bound):
+        # No need to run epsilons above the bound already proven for the path
+        self.epsilon = max(1.0, min(self.epsilon - self.delta_epsilon, bound))
+        # Move INCONS into OPEN, recompute every priority and empty CLOSED
+        cells = [cell for _, g_key, cell in self.open if self.in_open[cell] and -g_key == self.g_values[cell]]
+        for cell in self.incons:
+            self.in_incons[cell] = 0
+            if not self.in_open[cell]:
+                cells.append(cell)
+        self.incons = []
+        self.open = []
+        for cell in cells:
+            g_value = self.g_values[cell]
+            self.open.append((g_value + self.h(cell) * self.epsilon, -g_value, cell))
+            self.in_open[cell] = 1
+        heapq.heapify(self.open)
+        self.iteration += 1
+
+    def solutions(self, deadline=None):
+        # Yield every improved path or bound, until the path is proven optimal
+        # or the deadline is reached. The path follows the parents, which can be
+        # shorter than g(goal) and longer than an earlier path, so the shortest
+        # path found so far is yielded. Its length is at most g(goal), so the
+        # bound holds for it too.
+        time_start = time.perf_counter()
+        best_path = None
+        best_bound = None
+        while True:
+            if self.message_queue != None:
+                self.message_queue.put_nowait(message.Message(action="LOCK"))
+                self.message_queue.put_nowait(message.Message(action="CLEAR"))
+            if not self.improve_path(deadline):
+                return
+            goal_g = self.goal_g()
+            if goal_g == -1:
+                return
+            bound = self.bound()
+            path = astar.AStar.build_path(self.parents, self.end_cell)
+            if best_path == None or len(path) < len(best_path) or bound < best_bound:
+                if best_path == None or len(path) < len(best_path):
+                    best_path = path
+                best_bound = bound
+                run_time = (time.perf_counter() - time_start) * 1000
+                yield ARASolution(best_path, self.epsilon, bound, run_time, self.expanded)
+            if bound <= 1.0:
+                return
+            self.decrease_epsilon(bound)
+
+
+class ARAResult:
+    # Unpacks as (best_runtime, best_epsilon, limit_satisfied) like before
+    def __init__(self, path, best_runtime, best_epsilon, bound, limit_satisfied, timed_out, budget_used, stats=None):
+        self.path = path
+        self.stats = stats if stats != None else utilities.SearchStats()
+        self.best_runtime = best_runtime
+        self.best_epsilon = best_epsilon
+        # Suboptimality bound proven for the returned path
+        self.bound = bound
+        self.limit_satisfied = limit_satisfied
+        # Whether the deadline stopped the search and the fraction of time_limit spent
+        self.timed_out = timed_out
+        self.budget_used = budget_used
+
+    def __iter__(self):
+        return iter((self.best_runtime, self.best_epsilon, self.limit_satisfied))
+
+    def __getitem__(self, index):
+        return (self.best_runtime, self.best_epsilon, self.limit_satisfied)[index]
+
 
 class ARA:
     @staticmethod
+    @utilities.timer
     def search_map(map, heuristic, time_limit, epsilon=3.0, message_queue=None):
         delta_epsilon = 0.5
-        # Run path finding
-        search_result = astar.AStar.search_map(map, heuristic, epsilon, message_queue)
-        _, correct_path = astar.AStar.parse_result(*search_result, message_queue)
-        path_len = len(correct_path)
-        # Get running time
-        run_time = astar.AStar.search_map.time_elapsed
-        if message_queue != None:
-            message_queue.put_nowait(message.Message(action="ARA_INFO", param=(epsilon, path_len, run_time)))
-        # Check if time_limit is satisfied or not
-        limit_satisfied = run_time < time_limit
-        path_found = search_result[2]
+        time_start = time.perf_counter()
+        # time_limit is in milliseconds, the search stops as soon as it is spent
+        deadline = None
+        if time_limit != math.inf:
+            deadline = time_start + time_limit / 1000
+        # One EventQueue keeps drawing events and messages of every iteration in order
+        message_queue = message.EventQueue.wrap(message_queue, map.width)
+        search = ARASearch(map, heuristic, epsilon, delta_epsilon, message_queue)
+        best_path = []
+        best_runtime = 0.0
         best_epsilon = epsilon
-        best_runtime = run_time
-
-        while run_time < time_limit and epsilon > 1.0 and delta_epsilon >= 0.001 and path_found:
-            # Search with temporary epsilon
-            temp_epsilon = epsilon - delta_epsilon
-            # If decreasing epsilon make it smaller than 1.0
-            # decrease delta epsilon
-            # and continue
-            if temp_epsilon < 1.0:
-                delta_epsilon /= 2.0
-                continue
-
-            search_result = astar.AStar.search_map(map, heuristic, temp_epsilon, message_queue)
-            _, temp_correct_path = astar.AStar.parse_result(*search_result, message_queue)
-            temp_path_len = len(temp_correct_path)
-            path_found = search_result[2]
-            # Get running time
-            temp_time = astar.AStar.search_map.time_elapsed
-
-            # If temporary running time is acceptable
-            # update run_time and epsilon
-            if temp_time < time_limit and temp_epsilon >= 1.0:
-                run_time = temp_time
-                epsilon = temp_epsilon
-                # If path length is shorter
-                # this epsilon is better
-                if len(temp_correct_path) < len(correct_path):
-                    best_epsilon = epsilon
-                    correct_path = temp_correct_path
-                    best_runtime = run_time
-                    if message_queue != None:
-                        msg = message.Message(action="ARA_INFO")
-                        msg.param = (temp_epsilon, temp_path_len, temp_time)
-                        message_queue.put_nowait(msg)
-            # Else
-            # decrease delta epsilon
-            else:
-                delta_epsilon /= 2.0
-        
+        bound = math.inf
+        path_found = False
+
+        for solution in search.solutions(deadline):
+            path_found = True
+            bound = solution.bound
+            astar.AStar.parse_result(map, solution.path, True, message_queue)
+            # Report only iterations that improve the path length
+            if len(best_path) == 0 or len(solution.path) < len(best_path):
+                best_path = solution.path
+                best_epsilon = solution.epsilon
+                best_runtime = solution.run_time
+                if message_queue != None:
+                    msg = message.Message(action="ARA_INFO")
+                    msg.param = (solution.epsilon, len(best_path), solution.run_time)
+                    message_queue.put_nowait(msg)
+
+        run_time = (time.perf_counter() - time_start) * 1000
+        if not path_found:
+            astar.AStar.parse_result(map, [], False, message_queue)
+            if message_queue != None:
+                message_queue.put_nowait(message.Message(action="ARA_INFO", param=(epsilon, 0, run_time)))
         if message_queue != None:
             message_queue.put_nowait(message.Message(action="ARA_UNLOCK"))
-        return best_runtime, best_epsilon, (limit_satisfied and path_found)
\ No newline at end of file
+        budget_used = run_time / time_limit if time_limit > 0 else 1.0
+        stats = utilities.SearchStats(search.expanded, search.pushes, 0, search.peak_open, len(best_path) - 1)
+        return ARAResult(best_path, best_runtime, best_epsilon, bound, path_found, search.timed_out, budget_used, stats)
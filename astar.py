@@ -1,12 +1,12 @@
 import sys
-import heapq
-import copy
+import time
 import utilities
 import grid
 import message
 import threading
 import search_map
 import heuristic
+import queues
 
 class SearchNode:
     def __init__(self, position=search_map.Position(), parent=None):
@@ -14,73 +14,117 @@ class SearchNode:
         self.parent = parent
 
 
-class PriorityEntry:
-    def __init__(self, priority, data):
-        self.priority = priority
-        self.data = data
+class ResultGrid:
+    # The map annotated with a path ("S", "G", "x" on the path, "o" for walls,
+    # "-" for free blocks), built one row at a time from the map and the set of
+    # path cells instead of from a copy of the whole grid
+    SYMBOLS = bytes.maketrans(b"\x00\x01", b"-o")
+
+    def __init__(self, map, path):
+        self.map = map
+        # Path columns by row, start and end excluded
+        self.path_rows = {}
+        width = map.width
+        for cell in path[1:-1]:
+            self.path_rows.setdefault(cell // width - 1, []).append(cell % width - 1)
+
+    def row(self, x):
+        map = self.map
+        offset = (x + 1) * map.width + 1
+        row = list(bytes(map.cells[offset:offset + map.size]).translate(ResultGrid.SYMBOLS).decode())
+        for y in self.path_rows.get(x, []):
+            row[y] = "x"
+        if x == map.start.x:
+            row[map.start.y] = "S"
+        if x == map.end.x:
+            row[map.end.y] = "G"
+        return row
+
+    def __getitem__(self, x):
+        return self.row(x)
+
+    def __len__(self):
+        return self.map.size
+
+    def __iter__(self):
+        for x in range(self.map.size):
+            yield self.row(x)
+
+    def lines(self):
+        # Rows as written to output files, each value followed by a space
+        for row in self:
+            yield " ".join(row) + " "
+
+
+class SearchResult:
+    # Result of a search, unpacks as (map, path, path_found) where path is the
+    # list of cell ids from start to end
+    def __init__(self, map, path, path_found, stats=None, timed_out=False):
+        self.map = map
+        self.path = path
+        self.path_found = path_found
+        self.stats = stats if stats != None else utilities.SearchStats()
+        self.timed_out = timed_out
+
+    def __iter__(self):
+        return iter((self.map, self.path, self.path_found))
+
+    def __getitem__(self, index):
+        return (self.map, self.path, self.path_found)[index]
+
+
+class SearchBuffers:
+    # Per-cell buffers shared by successive searches on maps of the same size.
+    # Each search gets a new generation and stamps a block with 2 * generation
+    # when it is put in queue, 2 * generation + 1 when it is expanded. Values
+    # with an older stamp are ignored, so nothing is cleared between searches.
+    def __init__(self, map):
+        self.size = len(map.cells)
+        self.stamps = map.new_buffer(0)
+        self.g_values = map.new_buffer(-1)
+        self.parents = map.new_buffer(-1)
+        self.generation = 0
+
+    def fits(self, map):
+        return len(map.cells) == self.size
+
+    def next_generation(self):
+        self.generation += 1
+        return self.generation
 
-    def __lt__(self, other):
-        return self.priority < other.priority
 
+class AStar:
+    # Number of expansions between two deadline checks
+    CHECK_EVERY = 256
 
-class PriorityQueue:
-    def __init__(self):
-        self.queue = []
-
-    def push(self, item, priority):
-        heapq.heappush(self.queue, PriorityEntry(priority, item))
-
-    def pop(self):
-        return heapq.heappop(self.queue)
-
-    def empty(self):
-        return len(self.queue) == 0
+    @staticmethod
+    def build_path(parents, end_cell):
+        # Follow the predecessor buffer back from end to start
+        path = []
+        cell = end_cell
+        while cell != -1:
+            path.append(cell)
+            cell = parents[cell]
+        path.reverse()
+        return path
 
-class AStar:
     @staticmethod
-    def parse_result(map, open_list, path_found, message_queue=None):
+    def parse_result(map, path, path_found, message_queue=None):
         # Return result map with with the path from start to end
         result = -1
         correct_path = []
         if path_found:
-            result = copy.deepcopy(map.map)
-            result[map.start.x][map.start.y] = "S"
-            result[map.end.x][map.end.y] = "G"
-
-            for x in range(0, map.size):
-                for y in range(0, map.size):
-                    if result[x][y] == 1:
-                        result[x][y] = "o"
-                    elif result[x][y] == 0:
-                        result[x][y] = "-"
-
-            node = open_list[-1]
-            correct_path.append(node)
-            if message_queue != None:
-                msg = message.Message(action="PUSH", param=grid.Grid.CORRECT_PATH_ID)
-                msg.x = node.position.x
-                msg.y = node.position.y
-                message_queue.put_nowait(msg)
-            node = node.parent
-            while node.parent != None:
+            result = ResultGrid(map, path)
+            node = None
+            for cell in path:
+                node = SearchNode(map.position(cell), node)
                 correct_path.append(node)
-                if message_queue != None:
-                    msg = message.Message(action="PUSH", param=grid.Grid.CORRECT_PATH_ID)
-                    msg.x = node.position.x
-                    msg.y = node.position.y
-                    message_queue.put_nowait(msg)
-                x = node.position.x
-                y = node.position.y
-                result[x][y] = "x"
-                node = node.parent
-
-            correct_path.append(SearchNode(map.start))
+
             if message_queue != None:
-                msg = message.Message(action="PUSH", param=grid.Grid.CORRECT_PATH_ID)
-                msg.x = node.position.x
-                msg.y = node.position.y
-                message_queue.put_nowait(msg)
-            correct_path.reverse()
+                events = message.EventQueue.wrap(message_queue, map.width)
+                for cell in reversed(path):
+                    events.push(cell, grid.Grid.CORRECT_PATH_ID, keep=True)
+                message_queue = events
 
         if message_queue != None:
             message_queue.put_nowait(message.Message(action="UNLOCK", param=path_found))
@@ -88,134 +132,233 @@ class AStar:
 
     @staticmethod
     @utilities.timer
-    def search_map(map, heuristic, epsilon=1, message_queue=None):
-        # Create a map for checking if a block is in queue
-        check_map = utilities.Utilities.create_matrix(map.size, -1)
-        check_map[map.start.x][map.start.y] = 0
+    def search_map(map, heuristic, epsilon=1, message_queue=None, deadline=None, buffers=None, queue=None):
+        # deadline is a time.perf_counter() value, the search gives up once it is passed
+        # buffers can be reused between searches on maps of the same size
+        # queue is a queues backend class, a binary heap by default
+        # Every move costs 1, Map.costs is for engines with USES_COSTS
+        # Flat buffers indexed by cell id, walls come from the padded map border
+        cells = map.cells
+        width = map.width
+        offsets = map.neighbor_offsets()
+        wall = search_map.Map.WALL
+        if buffers == None or not buffers.fits(map):
+            buffers = SearchBuffers(map)
+        generation = buffers.next_generation()
+        seen = generation * 2
+        closed = seen + 1
+        # g value and parent of every block put in queue during this generation
+        stamps = buffers.stamps
+        g_values = buffers.g_values
+        parents = buffers.parents
+        start_cell = map.cell_id(map.start.x, map.start.y)
+        end_cell = map.cell_id(map.end.x, map.end.y)
+        if not map.is_valid(map.end.x, map.end.y):
+            end_cell = -1
+        # Heuristic is evaluated on one reused position instead of a new one per push,
+        # or looked up when it is a field precomputed for this end
+        probe = search_map.Position()
+        end = map.end
+        field = None
+        if hasattr(heuristic, "lookup"):
+            field = heuristic.lookup(map, end)
+        if queue == None:
+            queue = queues.HeapQueue
+        open_list = queue()
+        push = open_list.push
+        pop = open_list.pop
+        size = open_list.size
+        # Entries are (f, -g, cell) so ties prefer the deeper block. Integer
+        # backends get f rounded down, the same as rounding the heuristic down
+        # for the integer g values here.
+        integer_keys = queue.INTEGER_KEYS
 
         # Run algorithm
         path_found = False
-        open_list = []
-        queue = PriorityQueue()
+        path = []
+        expanded = 0
+        pushes = 0
+        duplicate_pops = 0
+        peak_open = 0
+        timed_out = False
+        check_every = AStar.CHECK_EVERY
+        # Drawing events are batched, a search without a queue pays nothing for them
+        events = message.EventQueue.wrap(message_queue, width)
         # Lock user input
-        if message_queue != None:
-            message_queue.put_nowait(message.Message(action="LOCK"))
+        if events != None:
+            events.put_nowait(message.Message(action="LOCK"))
         # Clear path
-        if message_queue != None:
-            message_queue.put_nowait(message.Message(action="CLEAR"))
-        node = SearchNode(map.start, None)
-        queue.push(node, heuristic(map.start, map.end))
-        while not queue.empty():
-            node = queue.pop()
+        if events != None:
+            events.put_nowait(message.Message(action="CLEAR"))
+        # Start must be a free block inside the map
+        if map.is_valid(map.start.x, map.start.y) and not map.is_wall(map.start.x, map.start.y):
+            stamps[start_cell] = seen
+            g_values[start_cell] = 0
+            parents[start_cell] = -1
+            h_value = heuristic(map.start, end) * epsilon
+            push((int(h_value) if integer_keys else h_value, 0, start_cell))
+            pushes += 1
+            peak_open = 1
+        while size() > 0:
+            _, _, cell = pop()
+            # Skip blocks already expanded, entries superseded by a better g come
+            # out after the better one
+            if stamps[cell] == closed:
+                duplicate_pops += 1
+                continue
+            stamps[cell] = closed
+            expanded += 1
+            if deadline != None and expanded % check_every == 0 and time.perf_counter() >= deadline:
+                timed_out = True
+                break
 
             # Request drawing
-            if message_queue != None:
-                pop_message = message.Message(action="PUSH", param=grid.Grid.POP_ID)
-                pop_message.x = node.data.position.x
-                pop_message.y = node.data.position.y
-                message_queue.put_nowait(pop_message)
-
-            node = node.data
-            x = node.position.x
-            y = node.position.y
-            if not map.is_valid(x, y) or map.is_wall(x, y):
-                break
-            open_list.append(node)
+            if events != None:
+                events.push(cell, grid.Grid.POP_ID)
 
             # If current node is end, stop
-            if x == map.end.x and y == map.end.y:
+            if cell == end_cell:
                 path_found = True
                 break
 
-            g_value = check_map[x][y] + 1
-            dxdyrange = [
-                (-1, -1),
-                (-1, 0),
-                (-1, 1),
-                (0, 1),
-                (1, 1),
-                (1, 0),
-                (1, -1),
-                (0, -1),
-            ]
-            for (dx, dy) in dxdyrange:
-                tempx = x + dx
-                tempy = y + dy
-                # Child is a wall or not valid
-                if not map.is_valid(tempx, tempy) or map.is_wall(tempx, tempy):
+            g_value = g_values[cell] + 1
+            for offset in offsets:
+                child = cell + offset
+                # Child is a wall, outside the map (the border is made of walls) or expanded
+                if cells[child] == wall:
+                    continue
+                stamp = stamps[child]
+                if stamp == closed:
                     continue
                 # Child is already in queue and has smaller g(x)
-                if check_map[tempx][tempy] != -1 and check_map[tempx][tempy] <= g_value:
+                if stamp == seen and g_values[child] <= g_value:
                     continue
 
                 # Otherwise, add child to queue
-                check_map[tempx][tempy] = g_value
-                child_pos = search_map.Position(tempx, tempy)
-                f_value = g_value + heuristic(child_pos, map.end) * epsilon
-                queue.push(SearchNode(child_pos, node), f_value)
+                stamps[child] = seen
+                g_values[child] = g_value
+                parents[child] = cell
+                if field != None:
+                    h_value = field[child]
+                else:
+                    probe.x = child // width - 1
+                    probe.y = child % width - 1
+                    h_value = heuristic(probe, end)
+                f_value = g_value + h_value * epsilon
+                push((int(f_value) if integer_keys else f_value, -g_value, child))
+                pushes += 1
+                if size() > peak_open:
+                    peak_open = size()
 
                 # Request drawing
-                if message_queue != None:
-                    in_queue_message = message.Message(action="PUSH", param=grid.Grid.IN_QUEUE_ID)
-                    in_queue_message.x = tempx
-                    in_queue_message.y = tempy
-                    message_queue.put_nowait(in_queue_message)
+                if events != None:
+                    events.push(child, grid.Grid.IN_QUEUE_ID)
 
-        return map, open_list, path_found
+        if events != None:
+            events.flush()
+        stats = utilities.SearchStats(expanded, pushes, duplicate_pops, peak_open)
+        if path_found:
+            path = AStar.build_path(parents, end_cell)
+            stats.path_cost = g_values[end_cell]
+        return SearchResult(map, path, path_found, stats, timed_out)
 
 class TestPathFinding:
-    def __init__(self, inp="", out="", time_input="", time_output=""):
+    # Path nodes written per chunk of the path line
+    CHUNK = 4096
+
+    def __init__(self, inp="", out="", time_input="", time_output="", path_only=False):
         self.input = inp
         self.output = out
+        # Write the path without the annotated map
+        self.path_only = path_only
         self.time_input = time_input
         self.time_output = time_output
 
     @staticmethod
-    def run_path_finding(map, heuristic, epsilon=1):
-        result, queue, path_found = AStar.search_map(
+    def run_path_finding(map, heuristic, epsilon=1, engine=None):
+        # engine is any class with AStar's search_map, AStar by default
+        if engine == None:
+            engine = AStar
+        result, queue, path_found = engine.search_map(
             map, heuristic, epsilon=epsilon)
         return AStar.parse_result(result, queue, path_found)
 
-    def run(self, heuristic):
+    def run(self, heuristic, engine=None):
         map = search_map.Map()
         map.read_from_file(self.input)
+        if map.costs != None and not getattr(engine if engine != None else AStar, "USES_COSTS", False):
+            raise Exception("{} has block costs, search it with the weighted engine".format(self.input))
 
         try:
-            with open(self.output, "w") as out:
-                result, path = TestPathFinding.run_path_finding(map, heuristic)
-                outdata = ""
+            # Rows are streamed to a buffered file instead of being joined first
+            with open(self.output, "w", buffering=1 << 16) as out:
+                result, path = TestPathFinding.run_path_finding(map, heuristic, engine=engine)
                 if len(path) > 0:
-                    outdata += "{}\n".format(len(path))
-                    for node in path:
-                        outdata += "({},{}) ".format(node.position.x,
-                                                     node.position.y)
-
-                    for x in result:
-                        if outdata != "":
-                            outdata += "\n"
-                        for y in x:
-                            outdata += str(y) + " "
+                    out.write("{}\n".format(len(path)))
+                    for index in range(0, len(path), TestPathFinding.CHUNK):
+                        out.write("".join("({},{}) ".format(node.position.x, node.position.y)
+                                          for node in path[index:index + TestPathFinding.CHUNK]))
+                    if not self.path_only:
+                        for line in result.lines():
+                            out.write("\n")
+                            out.write(line)
                 else:
-                    outdata = "-1"
-                out.write(outdata)
+                    out.write("-1")
         except IOError:
             print("Something went wrong while writing to {}".format(self.output))
-        finally:
-            out.close()
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3 or len(sys.argv) > 4:
+    if len(sys.argv) > 1 and sys.argv[1] == "--queries":
+        # Batch mode: astar.py --queries map queries output [heuristic]
+        if len(sys.argv) < 5 or len(sys.argv) > 6:
+            raise Exception("""Batch mode needs a map path, a query file path and an output path""")
+        import batch
+        h = heuristic.Heuristic.by_name(sys.argv[5] if len(sys.argv) == 6 else "")
+        map = search_map.Map()
+        if not map.read_from_file(sys.argv[2]):
+            raise Exception("Cannot read map from {}".format(sys.argv[2]))
+        if len(sys.argv) == 6 and sys.argv[5] == "alt":
+            h = heuristic.LandmarkHeuristic.for_map_file(map, sys.argv[2])
+        service = batch.PathService(map, h)
+        service.write_results(batch.PathService.read_queries(sys.argv[3]), sys.argv[4])
+        sys.exit(0)
+
+    utilities.Metrics.verbose = True
+    if len(sys.argv) < 3 or len(sys.argv) > 6:
         raise Exception("""This program needs at least 2 arguments for input path and output path""")
 
     input_path = sys.argv[1]
     output_path = sys.argv[2]
 
-    h = heuristic.Heuristic.euclidian_distance
-    if len(sys.argv) == 4:
-        if sys.argv[3] == "max":
-            h = heuristic.Heuristic.max_dx_dy
-        elif sys.argv[3] == "min":
-            h = heuristic.Heuristic.min_dx_dy
-
-    test = TestPathFinding(input_path, output_path)
-    test.run(h)
\ No newline at end of file
+    # Optional arguments pick the heuristic and the search engine
+    import jps
+    import bidirectional
+    import hpa
+    import weighted
+    engines = {
+        "astar": AStar,
+        "jps": jps.JPS,
+        "jps+": jps.JPSPlus,
+        "bidir": bidirectional.BidirectionalAStar,
+        "bidir-mp": bidirectional.ParallelBidirectionalAStar,
+        "hpa": hpa.HPA,
+        "weighted": weighted.WeightedAStar,
+    }
+    h = heuristic.Heuristic.by_name("")
+    engine = AStar
+    path_only = False
+    for option in sys.argv[3:]:
+        if option == "--path-only":
+            path_only = True
+        elif option in engines:
+            engine = engines[option]
+        elif option == "alt":
+            # Landmarks are read from, or saved to, the map path + ".landmarks"
+            map = search_map.Map()
+            map.read_from_file(input_path)
+            h = heuristic.LandmarkHeuristic.for_map_file(map, input_path)
+        else:
+            h = heuristic.Heuristic.by_name(option)
+
+    test = TestPathFinding(input_path, output_path, path_only=path_only)
+    test.run(h, engine)
\ No newline at end of file
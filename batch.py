@@ -0,0 +1,167 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import astar
+import cache
+import components
+import heuristic
+import search_map
+import trees
+import utilities
+
+# PathService of the current worker process, set up by ParallelPathService
+worker_service = None
+worker_memory = None
+
+class PathService:
+    # Answers many start/goal queries on one map. The map is loaded once and the
+    # search buffers are reused, so a query costs only the search itself.
+    # The service owns the map's start and end, which are set for every query.
+    # With a time_limit (milliseconds per query) searches run ARA* from
+    # ara_epsilon instead of A*.
+    def __init__(self, map, heuristic=heuristic.Heuristic.max_dx_dy, epsilon=1.0, cache_size=1024,
+                 tree_budget=64 * 1024 * 1024, time_limit=None, ara_epsilon=3.0):
+        # Components, trees and searches here all assume unit costs
+        if map.costs != None:
+            raise Exception("PathService does not support maps with block costs")
+        self.map = map
+        self.heuristic = heuristic
+        self.epsilon = epsilon
+        self.time_limit = time_limit
+        self.ara_epsilon = ara_epsilon
+        self.buffers = astar.SearchBuffers(map)
+        # Queries between different components are answered without a search
+        self.components = components.ComponentIndex(map)
+        # Repeated queries are answered from the cache until the map changes
+        self.cache = cache.PathCache(map, cache_size)
+        # Goals queried often are answered from a shortest path tree
+        self.trees = trees.GoalTreeStore(map, tree_budget)
+        # Heuristic fields of goals queried often, by (x, y)
+        self.fields = {}
+
+    def precompute_goal(self, goal):
+        # Later queries to goal look the heuristic up instead of computing it
+        self.fields[goal] = heuristic.HeuristicField(self.map, search_map.Position(goal[0], goal[1]), self.heuristic)
+
+    def query(self, start, goal):
+        # start and goal are (x, y) pairs
+        self.map.start = search_map.Position(start[0], start[1])
+        self.map.end = search_map.Position(goal[0], goal[1])
+        if not self.components.connected(self.map.start, self.map.end):
+            return astar.SearchResult(self.map, [], False, utilities.SearchStats(), False)
+        tree = self.trees.tree(tuple(goal))
+        if tree != None:
+            return tree.search(self.map.start)
+        h = self.fields.get(tuple(goal), self.heuristic)
+        if self.time_limit != None:
+            result = self.cache.search_ara(h, self.time_limit, self.ara_epsilon)
+            return astar.SearchResult(self.map, result.path, len(result.path) > 0, result.stats, result.timed_out)
+        return self.cache.search_map(h, self.epsilon, buffers=self.buffers)
+
+    def update_walls(self, positions):
+        # Walls at positions (x, y pairs) were edited on the map
+        self.components.update(positions)
+        # Landmark distances are rebuilt instead of falling back to octile
+        if hasattr(self.heuristic, "update"):
+            self.heuristic.update(self.map)
+
+    def run(self, queries):
+        # Results are streamed back in query order
+        for start, goal in queries:
+            yield start, goal, self.query(start, goal)
+
+    def format_result(self, result):
+        if not result.path_found:
+            return "-1"
+        data = ["{}".format(len(result.path))]
+        for cell in result.path:
+            position = self.map.position(cell)
+            data.append("({},{})".format(position.x, position.y))
+        return " ".join(data)
+
+    def write_results(self, queries, file_name):
+        # One line per query: path length and path, or -1 when there is no path
+        with open(file_name, "w") as out:
+            for _, _, result in self.run(queries):
+                out.write(self.format_result(result))
+                out.write("\n")
+
+    @staticmethod
+    def read_queries(file_name):
+        # One query per line: start x, start y, goal x, goal y
+        with open(file_name, "r") as file:
+            for line in file:
+                values = line.split()
+                if len(values) < 4:
+                    continue
+                yield (int(values[0]), int(values[1])), (int(values[2]), int(values[3]))
+
+
+def init_worker(memory_name, size, heuristic, epsilon, time_limit, ara_epsilon):
+    # Attach to the map shared by the parent process, without copying it
+    global worker_service, worker_memory
+    worker_memory = shared_memory.SharedMemory(name=memory_name)
+    map = search_map.Map()
+    map.use_buffer(worker_memory.buf[:(size + 2) * (size + 2)], size)
+    worker_service = PathService(map, heuristic, epsilon, time_limit=time_limit, ara_epsilon=ara_epsilon)
+
+
+def run_worker(task):
+    # task is (queries, goals to precompute), fields are built by each worker
+    # instead of being sent to it
+    queries, goals = task
+    for goal in goals:
+        if goal not in worker_service.fields:
+            worker_service.precompute_goal(goal)
+    results = []
+    for start, goal in queries:
+        result = worker_service.query(start, goal)
+        results.append((result.path, result.path_found, result.stats, result.timed_out))
+    return results
+
+
+class ParallelPathService:
+    # Runs batches of queries on a pool of processes, which sidesteps the GIL for
+    # the CPU-bound searches. Workers see the map through shared memory, so it is
+    # never pickled. They share a snapshot of the map taken at construction.
+    # time_limit and ara_epsilon switch the workers to ARA* like PathService.
+    def __init__(self, map, heuristic=heuristic.Heuristic.max_dx_dy, epsilon=1.0, processes=None,
+                 time_limit=None, ara_epsilon=3.0):
+        # Only the cells are shared with the workers, which search unit costs
+        if map.costs != None:
+            raise Exception("ParallelPathService does not support maps with block costs")
+        self.map = map
+        # Goals whose heuristic fields the workers precompute
+        self.goals = []
+        self.memory = shared_memory.SharedMemory(create=True, size=len(map.cells))
+        self.memory.buf[:len(map.cells)] = map.cells
+        self.pool = multiprocessing.Pool(
+            processes, init_worker, (self.memory.name, map.size, heuristic, epsilon, time_limit, ara_epsilon))
+
+    def precompute_goal(self, goal):
+        # Like PathService.precompute_goal, done by every worker on its next chunk
+        if tuple(goal) not in self.goals:
+            self.goals.append(tuple(goal))
+
+    def run(self, queries, chunk_size=64):
+        # Queries are sent in chunks and results streamed back in query order
+        queries = list(queries)
+        goals = tuple(self.goals)
+        chunks = [(queries[i:i + chunk_size], goals) for i in range(0, len(queries), chunk_size)]
+        index = 0
+        for results in self.pool.imap(run_worker, chunks):
+            for path, path_found, stats, timed_out in results:
+                start, goal = queries[index]
+                index += 1
+                yield start, goal, astar.SearchResult(self.map, path, path_found, stats, timed_out)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,257 @@
+import sys
+import math
+import json
+import random
+import tracemalloc
+import astar
+import ara
+import bidirectional
+import heuristic
+import hpa
+import jps
+import queues
+import search_map
+
+class Benchmark:
+    # Seeded map generators, engines and query sets, so the same command always
+    # measures the same work. Results are printed as a table and can be written
+    # as JSON to track regressions.
+
+    # Engines compared to the reference (A* with an admissible heuristic),
+    # "astar:<backend>" runs A* on one of queues.BACKENDS
+    ENGINES = ["astar", "jps", "jps+", "bidir", "hpa", "ara"]
+    QUEUE_ENGINES = ["astar:" + name for name in queues.BACKENDS]
+    GENERATORS = ["random", "maze", "rooms", "open"]
+    # Heuristic of the reference searches
+    REFERENCE = heuristic.Heuristic.max_dx_dy
+    # Queries run again under tracemalloc for the peak memory
+    MEMORY_QUERIES = 3
+
+    @staticmethod
+    def random_map(size, density=0.3, seed=0):
+        # Random obstacles, start and end in opposite corners are kept free
+        rng = random.Random(seed)
+        map = search_map.Map()
+        map.resize(size)
+        for x in range(size):
+            offset = (x + 1) * map.width + 1
+            map.cells[offset:offset + size] = bytes(1 if rng.random() < density else 0 for _ in range(size))
+        map.map[0][0] = 0
+        map.map[size - 1][size - 1] = 0
+        map.set_start_position(0, 0)
+        map.set_end_position(size - 1, size - 1)
+        return map
+
+    @staticmethod
+    def open_map(size, seed=0):
+        # Open field with a few scattered obstacles
+        return Benchmark.random_map(size, 0.02, seed)
+
+    @staticmethod
+    def maze_map(size, seed=0):
+        # Perfect maze carved by a randomized depth-first search: rooms on even
+        # coordinates, walls between them
+        rng = random.Random(seed)
+        map = search_map.Map()
+        map.resize(size, search_map.Map.WALL)
+        cells = map.cells
+        width = map.width
+        start = map.cell_id(0, 0)
+        cells[start] = 0
+        stack = [start]
+        while stack:
+            cell = stack[-1]
+            x, y = divmod(cell, width)
+            choices = []
+            for dx, dy in ((-2, 0), (0, 2), (2, 0), (0, -2)):
+                step = dx * width + dy
+                if 1 <= x + dx <= size and 1 <= y + dy <= size and cells[cell + step] == search_map.Map.WALL:
+                    choices.append(step)
+            if not choices:
+                stack.pop()
+                continue
+            step = rng.choice(choices)
+            cells[cell + step // 2] = 0
+            cells[cell + step] = 0
+            stack.append(cell + step)
+        end = (size - 1) // 2 * 2
+        map.set_start_position(0, 0)
+        map.set_end_position(end, end)
+        return map
+
+    @staticmethod
+    def rooms_map(size, seed=0, room_size=16):
+        # Square rooms separated by one block thick walls, each wall between two
+        # rooms has one door at a random place
+        rng = random.Random(seed)
+        map = search_map.Map()
+        map.resize(size)
+        cells = map.cells
+        for line in range(room_size, size, room_size + 1):
+            for other in range(size):
+                cells[map.cell_id(line, other)] = search_map.Map.WALL
+                cells[map.cell_id(other, line)] = search_map.Map.WALL
+        for line in range(room_size, size, room_size + 1):
+            for room in range(0, size, room_size + 1):
+                last = min(room + room_size, size) - 1
+                cells[map.cell_id(line, rng.randint(room, last))] = 0
+                cells[map.cell_id(rng.randint(room, last), line)] = 0
+        map.set_start_position(0, 0)
+        map.set_end_position(size - 1, size - 1)
+        map.map[size - 1][size - 1] = 0
+        return map
+
+    @staticmethod
+    def generate(name, size, seed=0):
+        if name == "maze":
+            return Benchmark.maze_map(size, seed)
+        elif name == "rooms":
+            return Benchmark.rooms_map(size, seed)
+        elif name == "open":
+            return Benchmark.open_map(size, seed)
+        return Benchmark.random_map(size, 0.3, seed)
+
+    @staticmethod
+    def load(file_name):
+        # Map file of the repository or any other one, text or binary
+        map = search_map.Map()
+        if not map.read_from_file(file_name):
+            raise Exception("Cannot read map from {}".format(file_name))
+        return map
+
+    @staticmethod
+    def queries(map, count, seed=0):
+        # count (start, goal) pairs of free blocks, drawn with a seeded generator
+        rng = random.Random(seed)
+        result = []
+        tries = 0
+        while len(result) < count and tries < count * 100:
+            tries += 1
+            start = (rng.randrange(map.size), rng.randrange(map.size))
+            goal = (rng.randrange(map.size), rng.randrange(map.size))
+            if not map.is_wall(*start) and not map.is_wall(*goal):
+                result.append((start, goal))
+        return result
+
+    @staticmethod
+    def engine(name, map):
+        # Search function for an engine, with what it precomputes per map built once
+        if name.startswith("astar:"):
+            backend = queues.BACKENDS[name[len("astar:"):]]
+            return lambda map, h, epsilon: astar.AStar.search_map(map, h, epsilon, queue=backend)
+        elif name == "ara":
+            return lambda map, h, epsilon: ara.ARA.search_map(map, h, math.inf, max(epsilon, 3.0))
+        elif name == "jps+":
+            table = jps.JumpTable(map)
+            return lambda map, h, epsilon: jps.JPS.search_map(map, h, epsilon, jump_table=table)
+        elif name == "hpa":
+            hierarchy = hpa.HierarchicalMap(map)
+            return lambda map, h, epsilon: hpa.HPA.search_map(map, h, epsilon, hierarchy=hierarchy)
+        engines = {
+            "astar": astar.AStar,
+            "jps": jps.JPS,
+            "bidir": bidirectional.BidirectionalAStar,
+            "bidir-mp": bidirectional.ParallelBidirectionalAStar,
+        }
+        return engines[name].search_map
+
+    @staticmethod
+    def percentile(values, fraction):
+        # Nearest-rank percentile
+        if len(values) == 0:
+            return 0.0
+        values = sorted(values)
+        return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+    @staticmethod
+    def run_queries(search, map, queries, heuristic, epsilon):
+        results = []
+        for start, goal in queries:
+            map.set_start_position(*start)
+            map.set_end_position(*goal)
+            result = search(map, heuristic, epsilon)
+            results.append((result.stats, len(result.path) - 1 if len(result.path) > 0 else -1))
+        return results
+
+    @staticmethod
+    def measure(name, map, queries, heuristic, epsilon, reference):
+        # reference holds the optimal cost of every query, -1 when there is no path
+        search = Benchmark.engine(name, map)
+        results = Benchmark.run_queries(search, map, queries, heuristic, epsilon)
+        latencies = [stats.wall_time for stats, _ in results]
+        expanded = sum(stats.expanded for stats, _ in results)
+        total_time = sum(latencies)
+        ratios = [cost / best for (_, cost), best in zip(results, reference) if cost > 0 and best > 0]
+        # Memory is traced in a second pass, tracing slows the searches down
+        tracemalloc.start()
+        Benchmark.run_queries(search, map, queries[:Benchmark.MEMORY_QUERIES], heuristic, epsilon)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            "engine": name,
+            "queries": len(queries),
+            "expanded": expanded,
+            "expanded_per_s": expanded / total_time * 1000 if total_time > 0 else 0.0,
+            "p50_ms": Benchmark.percentile(latencies, 0.5),
+            "p99_ms": Benchmark.percentile(latencies, 0.99),
+            "total_ms": total_time,
+            "peak_memory_kb": peak / 1024,
+            "found_mismatches": sum(1 for (_, cost), best in zip(results, reference) if (cost == -1) != (best == -1)),
+            "mean_cost_ratio": sum(ratios) / len(ratios) if ratios else 1.0,
+            "max_cost_ratio": max(ratios) if ratios else 1.0,
+        }
+
+    @staticmethod
+    def run(generators, sizes, engines, heuristic, epsilon=1.0, query_count=20, seed=0, files=()):
+        # Returns one record per map (generator and size, or file) and engine
+        maps = [(generator, size, lambda generator=generator, size=size: Benchmark.generate(generator, size, seed))
+                for generator in generators for size in sizes]
+        maps += [(file_name, 0, lambda file_name=file_name: Benchmark.load(file_name)) for file_name in files]
+        records = []
+        print("{:<12} {:>6} {:<14} {:>12} {:>10} {:>10} {:>12} {:>8} {:>10}".format(
+            "map", "size", "engine", "expanded/s", "p50 (ms)", "p99 (ms)", "memory (KB)", "missed", "max ratio"))
+        for map_name, size, build in maps:
+            map = build()
+            size = map.size
+            queries = Benchmark.queries(map, query_count, seed)
+            reference = [cost for _, cost in Benchmark.run_queries(
+                astar.AStar.search_map, map, queries, Benchmark.REFERENCE, 1.0)]
+            for name in engines:
+                record = Benchmark.measure(name, map, queries, heuristic, epsilon, reference)
+                record["map"] = map_name
+                record["size"] = size
+                record["seed"] = seed
+                records.append(record)
+                print("{:<12} {:>6} {:<14} {:>12.0f} {:>10.2f} {:>10.2f} {:>12.0f} {:>8} {:>10.3f}".format(
+                    map_name, size, name, record["expanded_per_s"], record["p50_ms"], record["p99_ms"],
+                    record["peak_memory_kb"], record["found_mismatches"], record["max_cost_ratio"]))
+        return records
+
+if __name__ == "__main__":
+    # benchmark.py [--sizes 256,1024] [--maps random,maze,rooms,open] [--engines astar,jps,...]
+    #              [--queries 20] [--seed 0] [--heuristic max] [--epsilon 1] [--json results.json]
+    #              [--files input.txt,test1.txt]
+    # --engines queues stands for A* on every priority queue backend, --maps "" and
+    # --files keep only map files, e.g. the ones of the repository
+    options = {"--sizes": "256,1024", "--maps": ",".join(Benchmark.GENERATORS),
+               "--engines": ",".join(Benchmark.ENGINES), "--queries": "20", "--seed": "0",
+               "--heuristic": "max", "--epsilon": "1", "--json": "", "--files": ""}
+    arguments = sys.argv[1:]
+    for index in range(0, len(arguments), 2):
+        if arguments[index] not in options or index + 1 >= len(arguments):
+            raise Exception("Unknown option {}".format(arguments[index]))
+        options[arguments[index]] = arguments[index + 1]
+    engines = []
+    for name in options["--engines"].split(","):
+        engines += Benchmark.QUEUE_ENGINES if name == "queues" else [name]
+    records = Benchmark.run([name for name in options["--maps"].split(",") if name != ""],
+                            [int(size) for size in options["--sizes"].split(",")],
+                            engines,
+                            heuristic.Heuristic.by_name(options["--heuristic"]),
+                            float(options["--epsilon"]),
+                            int(options["--queries"]),
+                            int(options["--seed"]),
+                            [name for name in options["--files"].split(",") if name != ""])
+    if options["--json"] != "":
+        with open(options["--json"], "w") as out:
+            json.dump(records, out, indent=2)
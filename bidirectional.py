@@ -0,0 +1,320 @@
+import math
+import time
+import heapq
+import multiprocessing
+from multiprocessing import shared_memory
+import astar
+import grid
+import message
+import search_map
+import utilities
+
+class Meeting:
+    # Best path found so far through a block reached by both frontiers
+    def __init__(self):
+        self.cost = math.inf
+        self.cell = -1
+
+    def offer(self, cost, cell):
+        if cost < self.cost:
+            self.cost = cost
+            self.cell = cell
+
+    def best(self):
+        return self.cost
+
+
+class SharedMeeting:
+    # Meeting shared by the two frontier processes
+    def __init__(self):
+        self.lock = multiprocessing.Lock()
+        self.cost = multiprocessing.Value("d", math.inf, lock=False)
+        self.cell = multiprocessing.Value("q", -1, lock=False)
+        self.done = multiprocessing.Value("b", 0, lock=False)
+        self.timed_out = multiprocessing.Value("b", 0, lock=False)
+
+    def offer(self, cost, cell):
+        if cost < self.cost.value:
+            with self.lock:
+                if cost < self.cost.value:
+                    self.cost.value = cost
+                    self.cell.value = cell
+
+    def best(self):
+        return self.cost.value
+
+
+class SharedValues:
+    # g values of a frontier running in another process, -1 when not reached
+    def __init__(self, g_values):
+        self.g_values = g_values
+
+    def known_g(self, cell):
+        return self.g_values[cell]
+
+
+class Frontier:
+    # One direction of the bidirectional search: an A* from source towards target
+    def __init__(self, map, source, target, heuristic, epsilon, stamps, g_values, parents, generation):
+        self.map = map
+        self.heuristic = heuristic
+        self.epsilon = epsilon
+        self.target = target
+        self.stamps = stamps
+        self.g_values = g_values
+        self.parents = parents
+        self.seen = generation * 2
+        self.closed = self.seen + 1
+        self.queue = []
+        self.expanded = 0
+        self.pushes = 0
+        self.duplicate_pops = 0
+        self.peak_open = 0
+        self.probe = search_map.Position()
+        self.field = None
+        if hasattr(heuristic, "lookup"):
+            self.field = heuristic.lookup(map, target)
+        self.source_cell = -1
+        if map.is_valid(source.x, source.y) and not map.is_wall(source.x, source.y):
+            self.source_cell = map.cell_id(source.x, source.y)
+            self.stamps[self.source_cell] = self.seen
+            self.g_values[self.source_cell] = 0
+            self.parents[self.source_cell] = -1
+            self.queue.append((heuristic(source, target), 0, self.source_cell))
+            self.pushes = 1
+            self.peak_open = 1
+
+    def known_g(self, cell):
+        stamp = self.stamps[cell]
+        if stamp == self.seen or stamp == self.closed:
+            return self.g_values[cell]
+        return -1
+
+    def top(self):
+        # Smallest f in queue after dropping stale entries, inf when empty
+        queue = self.queue
+        while queue:
+            _, g_key, cell = queue[0]
+            if self.stamps[cell] != self.closed and -g_key == self.g_values[cell]:
+                return queue[0][0]
+            heapq.heappop(queue)
+            self.duplicate_pops += 1
+        return math.inf
+
+    def expand(self, other, meeting, events=None):
+        # Expand the best block, offering every block also reached by other to meeting
+        _, _, cell = heapq.heappop(self.queue)
+        self.stamps[cell] = self.closed
+        self.expanded += 1
+        cells = self.map.cells
+        width = self.map.width
+        wall = search_map.Map.WALL
+        stamps = self.stamps
+        g_values = self.g_values
+
+        if events != None:
+            events.push(cell, grid.Grid.POP_ID)
+
+        other_g = other.known_g(cell)
+        if other_g != -1:
+            meeting.offer(g_values[cell] + other_g, cell)
+
+        g_value = g_values[cell] + 1
+        for offset in self.map.neighbor_offsets():
+            child = cell + offset
+            if cells[child] == wall:
+                continue
+            stamp = stamps[child]
+            if stamp == self.closed:
+                continue
+            if stamp == self.seen and g_values[child] <= g_value:
+                continue
+
+            stamps[child] = self.seen
+            g_values[child] = g_value
+            self.parents[child] = cell
+            other_g = other.known_g(child)
+            if other_g != -1:
+                meeting.offer(g_value + other_g, child)
+            if self.field != None:
+                h_value = self.field[child]
+            else:
+                self.probe.x = child // width - 1
+                self.probe.y = child % width - 1
+                h_value = self.heuristic(self.probe, self.target)
+            heapq.heappush(self.queue, (g_value + h_value * self.epsilon, -g_value, child))
+            self.pushes += 1
+            if len(self.queue) > self.peak_open:
+                self.peak_open = len(self.queue)
+
+            if events != None:
+                events.push(child, grid.Grid.IN_QUEUE_ID)
+
+    def stats(self):
+        return utilities.SearchStats(self.expanded, self.pushes, self.duplicate_pops, self.peak_open)
+
+
+def run_frontier(memory_name, size, forward, start, end, heuristic, epsilon, deadline, meeting, results):
+    # One frontier of BidirectionalAStar.search_map_parallel, in its own process
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        width = size + 2
+        count = width * width
+        buffer = memory.buf
+        map = search_map.Map()
+        map.use_buffer(buffer[:count], size)
+        arrays = buffer[count:count + 16 * count].cast("i")
+        g_forward = arrays[0:count]
+        parents_forward = arrays[count:2 * count]
+        g_backward = arrays[2 * count:3 * count]
+        parents_backward = arrays[3 * count:4 * count]
+        if forward:
+            frontier = Frontier(map, start, end, heuristic, epsilon, map.new_buffer(0),
+                                g_forward, parents_forward, 1)
+            other = SharedValues(g_backward)
+        else:
+            frontier = Frontier(map, end, start, heuristic, epsilon, map.new_buffer(0),
+                                g_backward, parents_backward, 1)
+            other = SharedValues(g_forward)
+
+        # f of the best open block bounds every path not found yet
+        while not meeting.done.value:
+            if frontier.top() >= meeting.best():
+                break
+            if (deadline != None and frontier.expanded % BidirectionalAStar.CHECK_EVERY == 0
+                    and time.perf_counter() >= deadline):
+                meeting.timed_out.value = 1
+                break
+            frontier.expand(other, meeting)
+        meeting.done.value = 1
+        results.put(frontier.stats())
+        # Views on the segment must go before it can be closed
+        del map, arrays, g_forward, parents_forward, g_backward, parents_backward, buffer, other, frontier
+    finally:
+        memory.close()
+
+
+class BidirectionalAStar:
+    # Front-to-end bidirectional A*: one A* from start towards end and one from end
+    # towards start, always expanding the frontier with the smaller queue. It stops
+    # when the best path through a meeting block costs no more than the smallest f
+    # of one of the queues, which bounds every path not found yet.
+
+    # Number of expansions between two deadline checks
+    CHECK_EVERY = 256
+
+    @staticmethod
+    def join_path(forward_parents, backward_parents, cell):
+        path = astar.AStar.build_path(forward_parents, cell)
+        cell = backward_parents[cell]
+        while cell != -1:
+            path.append(cell)
+            cell = backward_parents[cell]
+        return path
+
+    @staticmethod
+    @utilities.timer
+    def search_map(map, heuristic, epsilon=1, message_queue=None, deadline=None, buffers=None):
+        # buffers is a pair of SearchBuffers, one per direction
+        if buffers == None or not buffers[0].fits(map):
+            buffers = (astar.SearchBuffers(map), astar.SearchBuffers(map))
+        forward_buffers, backward_buffers = buffers
+        forward = Frontier(map, map.start, map.end, heuristic, epsilon, forward_buffers.stamps,
+                           forward_buffers.g_values, forward_buffers.parents, forward_buffers.next_generation())
+        backward = Frontier(map, map.end, map.start, heuristic, epsilon, backward_buffers.stamps,
+                            backward_buffers.g_values, backward_buffers.parents, backward_buffers.next_generation())
+        meeting = Meeting()
+        timed_out = False
+        events = message.EventQueue.wrap(message_queue, map.width)
+        if events != None:
+            events.put_nowait(message.Message(action="LOCK"))
+            events.put_nowait(message.Message(action="CLEAR"))
+        if map.is_valid(map.end.x, map.end.y):
+            expanded = 0
+            while True:
+                forward_top = forward.top()
+                backward_top = backward.top()
+                if meeting.best() <= max(forward_top, backward_top):
+                    break
+                if deadline != None and expanded % BidirectionalAStar.CHECK_EVERY == 0 and time.perf_counter() >= deadline:
+                    timed_out = True
+                    break
+                expanded += 1
+                if len(forward.queue) <= len(backward.queue):
+                    forward.expand(backward, meeting, events)
+                else:
+                    backward.expand(forward, meeting, events)
+        if events != None:
+            events.flush()
+
+        stats = utilities.SearchStats(
+            forward.expanded + backward.expanded,
+            forward.pushes + backward.pushes,
+            forward.duplicate_pops + backward.duplicate_pops,
+            forward.peak_open + backward.peak_open)
+        path = []
+        path_found = meeting.cell != -1 and not timed_out
+        if path_found:
+            path = BidirectionalAStar.join_path(forward.parents, backward.parents, meeting.cell)
+            stats.path_cost = len(path) - 1
+        return astar.SearchResult(map, path, path_found, stats, timed_out)
+
+    @staticmethod
+    @utilities.timer
+    def search_map_parallel(map, heuristic, epsilon=1, message_queue=None, deadline=None, buffers=None):
+        # Same search with each frontier in its own process, sharing the map, the
+        # g values and the parents through shared memory
+        # The frontiers draw nothing, the display is only cleared before they start
+        if message_queue != None:
+            message_queue.put_nowait(message.Message(action="LOCK"))
+            message_queue.put_nowait(message.Message(action="CLEAR"))
+        count = len(map.cells)
+        memory = shared_memory.SharedMemory(create=True, size=count + 16 * count)
+        try:
+            memory.buf[:count] = map.cells
+            # Every g value and parent starts at -1
+            memory.buf[count:] = b"\xff" * (16 * count)
+            arrays = memory.buf[count:].cast("i")
+            # Both sources are seeded before the processes start, so a frontier that
+            # reaches the other source meets it even if the other one has not run yet
+            if map.is_valid(map.start.x, map.start.y) and map.is_valid(map.end.x, map.end.y):
+                arrays[map.cell_id(map.start.x, map.start.y)] = 0
+                arrays[2 * count + map.cell_id(map.end.x, map.end.y)] = 0
+            meeting = SharedMeeting()
+            start = search_map.Position(map.start.x, map.start.y)
+            end = search_map.Position(map.end.x, map.end.y)
+            stats = utilities.SearchStats()
+            path = []
+            if map.is_valid(end.x, end.y):
+                results = multiprocessing.Queue()
+                processes = [multiprocessing.Process(target=run_frontier, args=(
+                    memory.name, map.size, forward, start, end, heuristic, epsilon, deadline, meeting, results))
+                    for forward in (True, False)]
+                for process in processes:
+                    process.start()
+                for _ in processes:
+                    frontier_stats = results.get()
+                    stats.expanded += frontier_stats.expanded
+                    stats.pushes += frontier_stats.pushes
+                    stats.duplicate_pops += frontier_stats.duplicate_pops
+                    stats.peak_open += frontier_stats.peak_open
+                for process in processes:
+                    process.join()
+            timed_out = meeting.timed_out.value == 1
+            path_found = meeting.cell.value != -1 and not timed_out
+            if path_found:
+                path = BidirectionalAStar.join_path(arrays[count:2 * count], arrays[3 * count:4 * count],
+                                                    meeting.cell.value)
+                stats.path_cost = len(path) - 1
+            arrays.release()
+        finally:
+            memory.close()
+            memory.unlink()
+        return astar.SearchResult(map, path, path_found, stats, timed_out)
+
+
+class ParallelBidirectionalAStar:
+    # Engine running BidirectionalAStar.search_map_parallel
+    @staticmethod
+    def search_map(map, heuristic, epsilon=1, message_queue=None, deadline=None, buffers=None):
+        return BidirectionalAStar.search_map_parallel(map, heuristic, epsilon, message_queue, deadline, buffers)
@@ -0,0 +1,76 @@
+import collections
+import threading
+import astar
+import ara
+import utilities
+
+class PathCache:
+    # Results of searches on one map, keyed by the map version, the endpoints, the
+    # engine, the heuristic and epsilon. Least recently used entries are evicted
+    # beyond capacity, and everything is dropped once the map version changes.
+    # Cached results are shared between callers and must not be modified.
+    def __init__(self, map, capacity=1024):
+        self.map = map
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.version = map.version
+        self.lock = threading.Lock()
+        self.stats = utilities.CacheStats()
+
+    def key(self, *parts):
+        map = self.map
+        return (map.start.x, map.start.y, map.end.x, map.end.y) + parts
+
+    def get(self, key):
+        stats = self.stats
+        with self.lock:
+            if self.map.version != self.version:
+                stats.invalidations += len(self.entries)
+                self.entries.clear()
+                self.version = self.map.version
+            result = self.entries.get(key)
+            if result == None:
+                stats.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                stats.hits += 1
+            stats.size = len(self.entries)
+        utilities.Metrics.publish("PathCache", stats)
+        return result
+
+    def put(self, key, version, result):
+        # version is the map version the result was searched on
+        with self.lock:
+            if version != self.version or self.capacity <= 0:
+                return
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.stats.evictions += 1
+            self.stats.size = len(self.entries)
+
+    def search_map(self, heuristic, epsilon=1, engine=astar.AStar, deadline=None, buffers=None):
+        # engine.search_map on the cached map, results cut short by the deadline are not kept
+        key = self.key(engine, heuristic, epsilon)
+        result = self.get(key)
+        if result == None:
+            version = self.map.version
+            result = engine.search_map(self.map, heuristic, epsilon, deadline=deadline, buffers=buffers)
+            if not result.timed_out:
+                self.put(key, version, result)
+        return result
+
+    def search_ara(self, heuristic, time_limit, epsilon=3.0):
+        # ARA.search_map on the cached map, only runs that finished within time_limit are kept
+        key = self.key(ara.ARA, heuristic, time_limit, epsilon)
+        result = self.get(key)
+        if result == None:
+            version = self.map.version
+            result = ara.ARA.search_map(self.map, heuristic, time_limit, epsilon)
+            if not result.timed_out:
+                self.put(key, version, result)
+        return result
+
+    def as_dict(self):
+        return self.stats.as_dict()
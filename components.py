@@ -0,0 +1,201 @@
+import array
+import collections
+import search_map
+
+class ComponentIndex:
+    # Connected components of the free blocks of a map, with the 8-connectivity
+    # (corner cutting included) of the searches. Two blocks are connected when the
+    # roots of their labels match, so unreachable queries are rejected without a
+    # search. Wall edits are folded in by update(), other edits of the map make
+    # the index rebuild itself on the next query.
+    def __init__(self, map):
+        self.map = map
+        self.build()
+
+    def find(self, label):
+        parents = self.parents
+        while parents[label] != label:
+            parents[label] = parents[parents[label]]
+            label = parents[label]
+        return label
+
+    def new_label(self):
+        self.parents.append(len(self.parents))
+        return len(self.parents) - 1
+
+    def build(self):
+        # Two passes over runs of free blocks: runs touching a run of the previous
+        # row (diagonally included) share its label, then every run is filled with
+        # the root of its label in one slice
+        map = self.map
+        # Label of every cell, 0 for walls. Labels merged by wall removals are
+        # joined through parents instead of relabeling their blocks.
+        self.labels = array.array("i", bytes(4 * len(map.cells)))
+        self.parents = [0]
+        # Map version the labels match
+        self.version = map.version
+        width = map.width
+        size = map.size
+        runs = []
+        previous = []
+        for x in range(1, size + 1):
+            offset = x * width + 1
+            row = bytes(map.cells[offset:offset + size])
+            current = []
+            y = row.find(0)
+            index = 0
+            while y != -1:
+                end = row.find(search_map.Map.WALL, y)
+                if end == -1:
+                    end = size
+                # Runs of the previous row ending before this one starts cannot touch it
+                while index < len(previous) and previous[index][1] < y:
+                    index += 1
+                label = 0
+                touching = index
+                while touching < len(previous) and previous[touching][0] <= end:
+                    other = self.find(previous[touching][2])
+                    if label == 0:
+                        label = other
+                    elif other != label:
+                        self.parents[other] = label
+                    touching += 1
+                if label == 0:
+                    label = self.new_label()
+                current.append((y, end, label))
+                runs.append((offset + y, end - y, label))
+                y = row.find(0, end)
+            previous = current
+
+        roots = {}
+        labels = self.labels
+        for start, length, label in runs:
+            root = self.find(label)
+            if root not in roots:
+                roots[root] = len(roots) + 1
+            labels[start:start + length] = array.array("i", [roots[root]]) * length
+        self.parents = list(range(len(roots) + 1))
+
+    def connected(self, start, end):
+        # Both positions are free and in the same component
+        if self.map.version != self.version:
+            self.build()
+        if not self.map.is_valid(start.x, start.y) or not self.map.is_valid(end.x, end.y):
+            return False
+        start_label = self.labels[self.map.cell_id(start.x, start.y)]
+        end_label = self.labels[self.map.cell_id(end.x, end.y)]
+        if start_label == 0 or end_label == 0:
+            return False
+        return self.find(start_label) == self.find(end_label)
+
+    def update(self, positions):
+        # Blocks at positions (x, y pairs) were edited on the map, which now has
+        # every edit applied. The labels go through the edits one at a time:
+        # removals first, then new walls, and the walls not handled yet still
+        # count as free blocks, so splits made by several new walls together
+        # are found by the last of them.
+        cells = self.map.cells
+        wall = search_map.Map.WALL
+        labels = self.labels
+        walls = []
+        for x, y in positions:
+            if not self.map.is_valid(x, y):
+                continue
+            cell = self.map.cell_id(x, y)
+            if cells[cell] == wall and labels[cell] != 0:
+                walls.append(cell)
+            elif cells[cell] != wall and labels[cell] == 0:
+                self.remove_wall(cell)
+        for cell in walls:
+            self.add_wall(cell)
+        self.version = self.map.version
+
+    def remove_wall(self, cell):
+        # The new free block joins every component around it
+        label = 0
+        for offset in self.map.neighbor_offsets():
+            other = self.labels[cell + offset]
+            if other == 0:
+                continue
+            other = self.find(other)
+            if label == 0:
+                label = other
+            elif other != label:
+                self.parents[other] = label
+        if label == 0:
+            label = self.new_label()
+        self.labels[cell] = label
+
+    def neighbor_groups(self, cell):
+        # Free neighbors of cell grouped by adjacency among themselves, blocks
+        # being free while they have a label
+        width = self.map.width
+        labels = self.labels
+        groups = []
+        for offset in self.map.neighbor_offsets():
+            neighbor = cell + offset
+            if labels[neighbor] == 0:
+                continue
+            x, y = divmod(neighbor, width)
+            joined = [neighbor]
+            for group in groups[:]:
+                if any(abs(other // width - x) <= 1 and abs(other % width - y) <= 1 for other in group):
+                    joined.extend(group)
+                    groups.remove(group)
+            groups.append(joined)
+        return groups
+
+    def add_wall(self, cell):
+        # The component may split. One breadth-first search per group of free
+        # neighbors runs in lockstep, searches that meet are merged, and a search
+        # that runs out of blocks is a component of its own and is relabeled. The
+        # last search left keeps the old label, so the work is bounded by the
+        # smaller parts.
+        labels = self.labels
+        labels[cell] = 0
+        groups = self.neighbor_groups(cell)
+        if len(groups) < 2:
+            return
+        offsets = self.map.neighbor_offsets()
+        owner = {}
+        frontiers = []
+        merged = list(range(len(groups)))
+        for index, group in enumerate(groups):
+            frontiers.append(collections.deque(group))
+            for neighbor in group:
+                owner[neighbor] = index
+
+        def root(index):
+            while merged[index] != index:
+                index = merged[index]
+            return index
+
+        active = set(range(len(groups)))
+        while len(active) > 1:
+            for index in list(active):
+                if index not in active or len(active) < 2:
+                    continue
+                frontier = frontiers[index]
+                if not frontier:
+                    label = self.new_label()
+                    for block, search in owner.items():
+                        if root(search) == index:
+                            labels[block] = label
+                    active.discard(index)
+                    continue
+                block = frontier.popleft()
+                for offset in offsets:
+                    child = block + offset
+                    if labels[child] == 0:
+                        continue
+                    search = owner.get(child)
+                    if search == None:
+                        owner[child] = index
+                        frontier.append(child)
+                        continue
+                    search = root(search)
+                    if search != index:
+                        merged[search] = index
+                        frontier.extend(frontiers[search])
+                        frontiers[search] = collections.deque()
+                        active.discard(search)
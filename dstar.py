@@ -0,0 +1,190 @@
+import math
+import time
+import heapq
+import astar
+import heuristic
+import search_map
+import utilities
+
+class DStarLite:
+    # D* Lite (Koenig and Likhachev) on the 8-connected unit-cost grid of AStar.
+    # The search runs backwards from the end, so g and rhs stay valid when walls
+    # change or the start moves, and replanning only touches the blocks whose
+    # distance to the end actually changed.
+    #
+    # The planner reads the map it was built for. After editing walls on that map,
+    # pass the edited positions to update() (Map.changed_positions gives them for
+    # two snapshots) and call plan() again. The heuristic must be consistent with
+    # unit diagonal moves (max_dx_dy, octile_distance or min_dx_dy), the Euclidian
+    # distance overestimates diagonals and can leave the repaired path broken.
+
+    # Number of expansions between two deadline checks
+    CHECK_EVERY = 256
+
+    def __init__(self, map, heuristic=heuristic.Heuristic.max_dx_dy):
+        self.map = map
+        self.heuristic = heuristic
+        self.start = search_map.Position(map.start.x, map.start.y)
+        self.end_cell = map.cell_id(map.end.x, map.end.y)
+        self.start_cell = map.cell_id(map.start.x, map.start.y)
+        self.g_values = map.new_buffer(math.inf)
+        self.rhs = map.new_buffer(math.inf)
+        # Key each block is queued with, None when it is not in the queue. Heap
+        # entries with another key are stale and dropped when popped.
+        self.keys = map.new_buffer(None)
+        self.queue = []
+        self.pushes = 0
+        self.key_modifier = 0
+        self.probe = search_map.Position()
+        if map.is_valid(map.end.x, map.end.y) and not map.is_wall(map.end.x, map.end.y):
+            self.rhs[self.end_cell] = 0
+            self.push(self.end_cell, (self.heuristic(self.start, map.end), 0))
+
+    def push(self, cell, key):
+        self.keys[cell] = key
+        heapq.heappush(self.queue, (key[0], key[1], cell))
+        self.pushes += 1
+
+    def top_key(self):
+        # Smallest valid key in the queue after dropping stale entries
+        queue = self.queue
+        while queue:
+            k1, k2, cell = queue[0]
+            key = self.keys[cell]
+            if key != None and key[0] == k1 and key[1] == k2:
+                return key
+            heapq.heappop(queue)
+        return (math.inf, math.inf)
+
+    def calculate_key(self, cell):
+        value = min(self.g_values[cell], self.rhs[cell])
+        width = self.map.width
+        self.probe.x = cell // width - 1
+        self.probe.y = cell % width - 1
+        return (value + self.heuristic(self.start, self.probe) + self.key_modifier, value)
+
+    def best_rhs(self, cell):
+        # One step plus the best g among the free neighbors, inf for walls
+        cells = self.map.cells
+        wall = search_map.Map.WALL
+        if cells[cell] == wall:
+            return math.inf
+        g_values = self.g_values
+        best = math.inf
+        for offset in self.map.neighbor_offsets():
+            child = cell + offset
+            if cells[child] != wall and g_values[child] < best:
+                best = g_values[child]
+        return best + 1
+
+    def update_vertex(self, cell):
+        if cell != self.end_cell:
+            self.rhs[cell] = self.best_rhs(cell)
+        if self.g_values[cell] != self.rhs[cell]:
+            self.push(cell, self.calculate_key(cell))
+        else:
+            self.keys[cell] = None
+
+    def update(self, positions):
+        # Walls at positions (x, y pairs) were added or removed: their cost changed
+        # for every edge touching them, so each block and its neighbors are redone
+        offsets = self.map.neighbor_offsets()
+        size = len(self.map.cells)
+        for x, y in positions:
+            if not self.map.is_valid(x, y):
+                continue
+            cell = self.map.cell_id(x, y)
+            if cell == self.end_cell and self.map.is_wall(x, y):
+                self.rhs[cell] = math.inf
+            elif cell == self.end_cell:
+                self.rhs[cell] = 0
+            self.update_vertex(cell)
+            for offset in offsets:
+                child = cell + offset
+                if 0 <= child < size:
+                    self.update_vertex(child)
+
+    def move_start(self, x, y):
+        # Keys already queued stay comparable by growing the key modifier
+        position = search_map.Position(x, y)
+        self.key_modifier += self.heuristic(self.start, position)
+        self.start = position
+        self.start_cell = self.map.cell_id(x, y)
+
+    def compute_shortest_path(self, stats, deadline=None):
+        # Returns False when the deadline stopped it, the state is still valid
+        # and the next call carries on from there
+        cells = self.map.cells
+        wall = search_map.Map.WALL
+        offsets = self.map.neighbor_offsets()
+        g_values = self.g_values
+        rhs = self.rhs
+        start_cell = self.start_cell
+        while True:
+            top = self.top_key()
+            start_key = self.calculate_key(start_cell)
+            if not (top < start_key or rhs[start_cell] != g_values[start_cell]):
+                return True
+            if top[0] == math.inf:
+                return True
+            if deadline != None and stats.expanded % DStarLite.CHECK_EVERY == 0 and time.perf_counter() >= deadline:
+                return False
+            _, _, cell = heapq.heappop(self.queue)
+            self.keys[cell] = None
+            stats.expanded += 1
+            new_key = self.calculate_key(cell)
+            if top < new_key:
+                self.push(cell, new_key)
+            elif g_values[cell] > rhs[cell]:
+                g_values[cell] = rhs[cell]
+                for offset in offsets:
+                    child = cell + offset
+                    if cells[child] != wall:
+                        self.update_vertex(child)
+            else:
+                g_values[cell] = math.inf
+                self.update_vertex(cell)
+                for offset in offsets:
+                    child = cell + offset
+                    if cells[child] != wall:
+                        self.update_vertex(child)
+            if len(self.queue) > stats.peak_open:
+                stats.peak_open = len(self.queue)
+
+    def extract_path(self):
+        # Follow the best neighbor from the start down to the end
+        cells = self.map.cells
+        wall = search_map.Map.WALL
+        g_values = self.g_values
+        cell = self.start_cell
+        if cells[cell] == wall or g_values[cell] == math.inf:
+            return []
+        path = [cell]
+        offsets = self.map.neighbor_offsets()
+        while cell != self.end_cell:
+            best = -1
+            for offset in offsets:
+                child = cell + offset
+                if cells[child] != wall and (best == -1 or g_values[child] < g_values[best]):
+                    best = child
+            if best == -1 or g_values[best] == math.inf or len(path) > len(cells):
+                return []
+            cell = best
+            path.append(cell)
+        return path
+
+    @utilities.timer
+    def plan(self, deadline=None):
+        # Repair the distances after the latest updates and return the path from
+        # the current start as a SearchResult
+        stats = utilities.SearchStats()
+        pushes = self.pushes
+        timed_out = not self.compute_shortest_path(stats, deadline)
+        stats.pushes = self.pushes - pushes
+        path = []
+        if not timed_out:
+            path = self.extract_path()
+        path_found = len(path) > 0
+        if path_found:
+            stats.path_cost = len(path) - 1
+        return astar.SearchResult(self.map, path, path_found, stats, timed_out)
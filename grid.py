@@ -1,21 +1,5 @@
 import utilities
 
-class GridItem:
-    def __init__(self):
-        self.stack = []
-    
-    def push(self, value):
-        self.stack.append(value)
-    
-    def top(self):
-        return self.stack[-1]
-
-    def pop(self, value):
-        self.stack = list(filter(lambda a: a != value, self.stack))
-    
-    def empty(self):
-        return len(self.stack) == 0
-
 class Grid:
     NO_WALL_ID = 0
     WALL_ID = 1
@@ -24,21 +8,31 @@ class Grid:
     POP_ID = 4
     CORRECT_PATH_ID = 5
 
+    # Every cell is one byte with a bit per layer (1 << id) set while the value is
+    # pushed on it. The value shown is the set layer coming last here, walls
+    # drawn over a searched block hide the search like they did on a stack.
+    PRIORITY = [NO_WALL_ID, IN_QUEUE_ID, POP_ID, CORRECT_PATH_ID, WALL_ID, START_END_ID]
+
     def __init__(self, size):
-        self.grid_items = utilities.Utilities.create_grid(size, size, Grid.NO_WALL_ID) 
-        self.row_num = size 
-        self.col_num = size 
+        self.row_num = size
+        self.col_num = size
+        self.layers = bytearray(size * size)
         self.rect_size = [20, 20]
         self.margin = 1
+        # Cells changed since the last frame, or everything when all_dirty is set
+        self.dirty = set()
+        self.all_dirty = True
 
     def load_map(self, map):
         self.row_num = map.size
-        self.col_num = map.size 
-        self.grid_items = utilities.Utilities.create_grid(self.row_num, self.col_num, Grid.NO_WALL_ID)
+        self.col_num = map.size
+        # Walls of a map row become the wall layer in one translate
+        walls = bytes.maketrans(b"\x00\x01", bytes([0, 1 << Grid.WALL_ID]))
+        self.layers = bytearray()
         for row in range(self.row_num):
-            for col in range(self.col_num):
-                if map.map[row][col] == 1:
-                    self.grid_items[row][col].push(Grid.WALL_ID)
+            offset = (row + 1) * map.width + 1
+            self.layers += bytes(map.cells[offset:offset + map.size]).translate(walls)
+        self.all_dirty = True
         self.pop_grid_value(map.start.x, map.start.y, Grid.WALL_ID)
         self.push_grid_value(map.start.x, map.start.y, Grid.START_END_ID)
 
@@ -46,37 +40,62 @@ class Grid:
         self.push_grid_value(map.end.x, map.end.y, Grid.START_END_ID)
 
         return map.start.x, map.start.y, map.end.x, map.end.y, map
-    
+
     def save_map(self):
         # Map size and grid size not matched
         # Create new map
         map = utilities.Utilities.create_map(self.row_num, 0)
         for row in range(self.row_num):
-            for col in range(self.col_num):
-                value = self.get_grid_value(row, col)
-                if value == Grid.NO_WALL_ID:
-                    map.map[row][col] = 0
-                elif value == Grid.WALL_ID:
-                    map.map[row][col] = 1
+            offset = (row + 1) * map.width + 1
+            start = row * self.col_num
+            map.cells[offset:offset + self.col_num] = self.layers[start:start + self.col_num].translate(Grid.WALLS)
+        map.changed()
         return map
-    
+
     def calculate_rect_size(self, screen_width, screen_height):
         self.rect_size[0] = (screen_width - self.margin * (self.col_num + 1)) / self.col_num
         self.rect_size[1] = (screen_height - self.margin * (self.row_num + 1)) / self.row_num
+        self.all_dirty = True
 
     def push_grid_value(self, x, y, value):
-        self.grid_items[x][y].push(value)
-    
+        self.layers[x * self.col_num + y] |= 1 << value
+        self.dirty.add((x, y))
+
     def pop_grid_value(self, x, y, value):
-        self.grid_items[x][y].pop(value)
-    
-    def get_grid_value(self, x, y):
-        return self.grid_items[x][y].top()
+        self.layers[x * self.col_num + y] &= ~(1 << value) & 0xff
+        self.dirty.add((x, y))
 
-    def get_grid_item(self, x, y):
-        return self.grid_items[x][y]
+    def clear_layers(self, values):
+        # Pop values from every cell at once
+        mask = 0
+        for value in values:
+            mask |= 1 << value
+        self.layers = self.layers.translate(bytes(cell & ~mask for cell in range(256)))
+        self.all_dirty = True
+
+    def take_dirty(self):
+        # Whether everything must be redrawn and the cells changed since last call
+        all_dirty, dirty = self.all_dirty, self.dirty
+        self.all_dirty = False
+        self.dirty = set()
+        return all_dirty, dirty
+
+    def get_grid_value(self, x, y):
+        return Grid.TOP[self.layers[x * self.col_num + y]]
 
     def is_valid_position(self, x, y):
         if x < 0 or x >= self.row_num or y < 0 or y >= self.col_num:
             return False
-        return True
\ No newline at end of file
+        return True
+
+
+def top_value(mask):
+    value = Grid.NO_WALL_ID
+    for layer in Grid.PRIORITY:
+        if mask & (1 << layer):
+            value = layer
+    return value
+
+# Shown value of every cell byte, and 1 where the wall layer is set
+Grid.TOP = bytes(top_value(mask) for mask in range(256))
+Grid.WALLS = bytes(1 if mask & (1 << Grid.WALL_ID) else 0 for mask in range(256))
\ No newline at end of file
@@ -4,9 +4,9 @@ import os
 import tkinter
 from tkinter import messagebox
 from tkinter import simpledialog 
-import astar
 import heuristic
 import grid
+import message
 import search_thread
 import search_map
 
@@ -82,15 +82,24 @@ class Window:
         pygame.display.flip()
 
 class Application:
+    # Messages (batches of drawing events included) waiting for the window at most
+    QUEUED_MESSAGES = 64
+    # Drawing events sent together, seconds between two batches and one event
+    # drawn out of EVENT_SAMPLE
+    EVENT_BATCH_SIZE = 256
+    EVENT_INTERVAL = 1 / 60
+    EVENT_SAMPLE = 1
+
     def __init__(self):
         self.window = Window()
         self.is_done = False
         self.clock = pygame.time.Clock()
-        self.current_time = 0
         self.input_lock = False
         self.heuristic = heuristic.Heuristic.euclidian_distance
         self.epsilon = 1.0
-        self.message_queue = queue.Queue()
+        # Bounded, so a search waits for the drawing instead of piling up batches
+        self.message_queue = queue.Queue(Application.QUEUED_MESSAGES)
+        self.events = None
         self.time_limited = True
         self.limit = -1
 
@@ -98,11 +107,11 @@ class Application:
         if self.prompt_algorithm():
             while self.limit == -1:
                 self.limit = self.prompt_time_limit()
-            self.search_thread = search_thread.ARAThread(limit=self.limit, message_queue=self.message_queue)
+            self.search_thread = search_thread.ARAThread(limit=self.limit, message_queue=self.new_events())
             self.epsilon = 3.0
         else:
-            self.search_thread = search_thread.AStarThread(message_queue=self.message_queue)
             self.time_limited = False
+            self.search_thread = search_thread.AStarThread(message_queue=self.new_events())
         
         self.search_thread.heuristic = self.heuristic
         self.search_thread.epsilon = self.epsilon
@@ -166,11 +175,19 @@ class Application:
         else:
             self.prompt_message("Error saving map", "ERROR")
     
+    def new_events(self):
+        # Drawing events of the next search, a search on a time budget drops
+        # batches instead of waiting for the window
+        self.events = message.EventQueue(self.message_queue, batch_size=Application.EVENT_BATCH_SIZE,
+                                         interval=Application.EVENT_INTERVAL, sample=Application.EVENT_SAMPLE,
+                                         drop_batches=self.time_limited)
+        return self.events
+
     def prepare_thread(self):
         if self.time_limited:
-            self.search_thread = search_thread.ARAThread(limit=self.limit, epsilon=self.epsilon, message_queue=self.message_queue, heuristic=self.heuristic)
+            self.search_thread = search_thread.ARAThread(limit=self.limit, epsilon=self.epsilon, message_queue=self.new_events(), heuristic=self.heuristic)
         else:
-            self.search_thread = search_thread.AStarThread(message_queue=self.message_queue, heuristic=self.heuristic, epsilon=self.epsilon)
+            self.search_thread = search_thread.AStarThread(message_queue=self.new_events(), heuristic=self.heuristic, epsilon=self.epsilon)
     
     def prompt_exit(self):
         tkinter.Tk().wm_withdraw()
@@ -188,6 +205,7 @@ class Application:
         msg = "EUCLIDIAN - Euclidian distance\n"
         msg += "MAX DX DY - Maximum of dx and dy\n"
         msg += "MIN DX DY - Minimum of dx and dy\n"
+        msg += "OCTILE - Octile distance\n"
         msg += "Your choice:"
         chosen_heuristic = simpledialog.askstring("Heuristic", msg)
         if chosen_heuristic == None:
@@ -200,6 +218,8 @@ class Application:
             thread_heuristic = heuristic.Heuristic.max_dx_dy
         elif chosen_heuristic == "MIN DX DY":
             thread_heuristic = heuristic.Heuristic.min_dx_dy
+        elif chosen_heuristic == "OCTILE":
+            thread_heuristic = heuristic.Heuristic.octile_distance
         else:
             self.prompt_message("Unknown heuristic function, use Euclidian distance as default", "ERROR")
             thread_heuristic = heuristic.Heuristic.euclidian_distance
@@ -250,6 +270,9 @@ class Application:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.prompt_exit()
+            elif event.type == pygame.VIDEOEXPOSE or event.type == pygame.ACTIVEEVENT:
+                # Dialogs may have covered the window
+                self.gui_grid.all_dirty = True
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.prompt_exit()
@@ -349,14 +372,8 @@ class Application:
             self.modify_wall(*self.get_item_at_mouse_position())
 
     def handle_message(self):
-        time_got = pygame.time.get_ticks()
-        elapsed_time = time_got - self.current_time
-        if self.time_limited and elapsed_time < 1:
-            return
-        if not self.time_limited and elapsed_time < 10:
-            return
-        self.current_time = time_got
-        if not self.message_queue.empty():
+        # Handle every waiting message, up to one batch of drawing events per frame
+        while not self.message_queue.empty():
             message = self.message_queue.get_nowait()
             action = message.action
             if action == "LOCK":
@@ -365,7 +382,7 @@ class Application:
                 self.input_lock = False
                 if self.time_limited:
                     return
-                msg = "Searching finished in {} ms\n".format(astar.AStar.search_map.time_elapsed)
+                msg = "Searching finished in {} ms\n".format(self.search_thread.stats.wall_time)
                 if message.param:
                     msg += "Path length is {}\n".format(len(self.search_thread.result[1]))
                 else:
@@ -385,6 +402,11 @@ class Application:
                 self.gui_grid.pop_grid_value(message.x, message.y, message.param)
             elif action == "PUSH":
                 self.gui_grid.push_grid_value(message.x, message.y, message.param)
+            elif action == "BATCH":
+                width, cells, values = message.param
+                for cell, value in zip(cells, values):
+                    self.gui_grid.push_grid_value(cell // width - 1, cell % width - 1, value)
+                return
             elif action == "CLEAR":
                 self.clear_path()
             elif action == "ARA_INFO":
@@ -399,54 +421,60 @@ class Application:
 
     def clear_start_end(self):
         if self.start["added"]:
-            self.gui_grid.push_grid_value(self.start["position"].x, self.start["position"].y, grid.Grid.NO_WALL_ID)
+            self.gui_grid.pop_grid_value(self.start["position"].x, self.start["position"].y, grid.Grid.START_END_ID)
             self.start["position"] = search_map.Position(-1, -1)
             self.start["added"] = False
         if self.end["added"]:
-            self.gui_grid.push_grid_value(self.end["position"].x, self.end["position"].y, grid.Grid.NO_WALL_ID)
+            self.gui_grid.pop_grid_value(self.end["position"].x, self.end["position"].y, grid.Grid.START_END_ID)
             self.end["position"] = search_map.Position(-1, -1)
             self.end["added"] = False
 
     def clear_path(self):
-        for row in range(self.gui_grid.row_num):
-            for col in range(self.gui_grid.col_num):
-                self.gui_grid.pop_grid_value(row, col, grid.Grid.POP_ID)
-                self.gui_grid.pop_grid_value(row, col, grid.Grid.IN_QUEUE_ID)
-                self.gui_grid.pop_grid_value(row, col, grid.Grid.CORRECT_PATH_ID)
+        self.gui_grid.clear_layers([grid.Grid.POP_ID, grid.Grid.IN_QUEUE_ID, grid.Grid.CORRECT_PATH_ID])
     
     def clear_walls(self):
-        for row in range(self.gui_grid.row_num):
-            for col in range(self.gui_grid.col_num):
-                self.gui_grid.pop_grid_value(row, col, grid.Grid.WALL_ID)
+        self.gui_grid.clear_layers([grid.Grid.WALL_ID])
     
     def clear_all(self):
         self.clear_path()
         self.clear_start_end()
         self.clear_walls()
 
+    def cell_rect(self, row, col):
+        return pygame.Rect(
+            (self.gui_grid.rect_size[0] + self.gui_grid.margin) * col + self.gui_grid.margin,
+            (self.gui_grid.rect_size[1] + self.gui_grid.margin) * row + self.gui_grid.margin,
+            self.gui_grid.rect_size[0],
+            self.gui_grid.rect_size[1])
+
+    def draw_cell(self, row, col):
+        grid_item_value = self.gui_grid.get_grid_value(row, col)
+        color = Color.COLOR_DICT["WHITE"]
+        if grid_item_value == grid.Grid.START_END_ID or grid_item_value == grid.Grid.CORRECT_PATH_ID:
+            color = Color.COLOR_DICT["RED"]
+        elif grid_item_value == grid.Grid.WALL_ID:
+            color = Color.COLOR_DICT["GREY"]
+        elif grid_item_value == grid.Grid.POP_ID:
+            color = Color.COLOR_DICT["YELLOW"]
+        elif grid_item_value == grid.Grid.IN_QUEUE_ID:
+            color = Color.COLOR_DICT["LIGHT_GREEN"]
+        return pygame.draw.rect(self.window.screen, color, self.cell_rect(row, col))
+
     def render(self):
-        self.window.screen.fill(Color.COLOR_DICT["LIGHT_GREY"])
-        self.window.instructions()
-        for row in range(self.gui_grid.row_num):
-            for col in range(self.gui_grid.col_num):
-                grid_item_value = self.gui_grid.grid_items[row][col].top()
-                color = Color.COLOR_DICT["WHITE"]
-                if grid_item_value == grid.Grid.START_END_ID or grid_item_value == grid.Grid.CORRECT_PATH_ID:
-                    color = Color.COLOR_DICT["RED"]
-                elif grid_item_value == grid.Grid.WALL_ID:
-                    color = Color.COLOR_DICT["GREY"]
-                elif grid_item_value == grid.Grid.POP_ID:
-                    color = Color.COLOR_DICT["YELLOW"]
-                elif grid_item_value == grid.Grid.IN_QUEUE_ID:
-                    color = Color.COLOR_DICT["LIGHT_GREEN"]
-
-                pygame.draw.rect(self.window.screen, color, [
-                    (self.gui_grid.rect_size[0] + self.gui_grid.margin) * col + self.gui_grid.margin,
-                    (self.gui_grid.rect_size[1] + self.gui_grid.margin) * row + self.gui_grid.margin,
-                    self.gui_grid.rect_size[0],
-                    self.gui_grid.rect_size[1]
-                ])
-        self.window.display()
+        # Only cells changed since the last frame are drawn and sent to the display,
+        # the whole window is redrawn after a new map, a resize or an expose
+        all_dirty, dirty = self.gui_grid.take_dirty()
+        if all_dirty:
+            self.window.screen.fill(Color.COLOR_DICT["LIGHT_GREY"])
+            self.window.instructions()
+            for row in range(self.gui_grid.row_num):
+                for col in range(self.gui_grid.col_num):
+                    self.draw_cell(row, col)
+            self.window.display()
+        elif len(dirty) > 0:
+            rects = [self.draw_cell(row, col) for row, col in dirty
+                     if self.gui_grid.is_valid_position(row, col)]
+            pygame.display.update(rects)
 
     def run(self):
         while not self.is_done:
@@ -455,6 +483,9 @@ class Application:
             self.handle_message()
             self.render()
         pygame.quit()
+        # Nothing reads the queue any more, a search waiting on it must give up
+        if self.events != None:
+            self.events.cancel()
         if self.search_thread.started:
             self.search_thread.join()
 
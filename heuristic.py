@@ -1,10 +1,18 @@
 import math
+import array
+import struct
+import zlib
+import search_map
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class Heuristic:
     @staticmethod
     def euclidian_distance(p1, p2):
         return math.sqrt((p1.x - p2.x) ** 2 + (p1.y - p2.y) ** 2)
-    
+
     @staticmethod
     def min_dx_dy(p1, p2):
         dx = abs(p1.x - p2.x)
@@ -15,4 +23,273 @@ class Heuristic:
     def max_dx_dy(p1, p2):
         dx = abs(p1.x - p2.x)
         dy = abs(p1.y - p2.y)
-        return dy if dx < dy else dx
\ No newline at end of file
+        return dy if dx < dy else dx
+
+    @staticmethod
+    def octile_distance(p1, p2, diagonal_cost=1):
+        # Exact distance on an empty 8-connected grid with unit straight moves,
+        # with the unit diagonal moves of the searches it equals max_dx_dy
+        dx = abs(p1.x - p2.x)
+        dy = abs(p1.y - p2.y)
+        if dx < dy:
+            dx, dy = dy, dx
+        return dx + (diagonal_cost - 1) * dy
+
+    @staticmethod
+    def by_name(name):
+        # Names accepted on the command line, Euclidian distance by default
+        if name == "max":
+            return Heuristic.max_dx_dy
+        elif name == "min":
+            return Heuristic.min_dx_dy
+        elif name == "octile":
+            return Heuristic.octile_distance
+        return Heuristic.euclidian_distance
+
+    @staticmethod
+    def evaluate(heuristic, xs, ys, goal):
+        # Heuristic from many blocks (sequences of x and y) to goal at once,
+        # vectorized with NumPy when it is installed
+        if numpy != None:
+            dx = numpy.abs(numpy.asarray(xs, dtype=numpy.float64) - goal.x)
+            dy = numpy.abs(numpy.asarray(ys, dtype=numpy.float64) - goal.y)
+            if heuristic == Heuristic.euclidian_distance:
+                return numpy.sqrt(dx * dx + dy * dy)
+            elif heuristic == Heuristic.min_dx_dy:
+                return numpy.minimum(dx, dy)
+            elif heuristic == Heuristic.max_dx_dy or heuristic == Heuristic.octile_distance:
+                return numpy.maximum(dx, dy)
+        position = search_map.Position()
+        values = []
+        for x, y in zip(xs, ys):
+            position.x = x
+            position.y = y
+            values.append(heuristic(position, goal))
+        return values
+
+
+class HeuristicField:
+    # Heuristic of every block of a map towards one goal, computed once over the
+    # whole grid. Searches to that goal look values up by cell id instead of
+    # calling the heuristic, other goals fall back to the heuristic itself.
+    def __init__(self, map, goal, heuristic=Heuristic.octile_distance):
+        self.heuristic = heuristic
+        self.goal = search_map.Position(goal.x, goal.y)
+        self.width = map.width
+        # Coordinates of every cell id, border included
+        if numpy != None:
+            cells = numpy.arange(len(map.cells))
+            values = Heuristic.evaluate(heuristic, cells // self.width - 1, cells % self.width - 1, self.goal)
+            self.values = array.array("d", numpy.asarray(values, dtype=numpy.float64).tobytes())
+        else:
+            xs = [cell // self.width - 1 for cell in range(len(map.cells))]
+            ys = [cell % self.width - 1 for cell in range(len(map.cells))]
+            self.values = array.array("d", Heuristic.evaluate(heuristic, xs, ys, self.goal))
+
+    def __call__(self, p1, p2):
+        if p2 == self.goal:
+            return self.values[(p1.x + 1) * self.width + p1.y + 1]
+        return self.heuristic(p1, p2)
+
+    def lookup(self, map, end):
+        # Flat values for a search on map towards end, None if the field does not apply
+        if map.width != self.width or end != self.goal:
+            return None
+        return self.values
+
+
+class LandmarkHeuristic:
+    # ALT heuristic: exact distances from a few landmark blocks, and for any two
+    # blocks p and q the triangle inequality |d(L, p) - d(L, q)| <= d(p, q) for
+    # every landmark L. It stays admissible for the unit moves of the searches
+    # and is much tighter than geometric distances around walls. The octile
+    # distance is used as a floor.
+
+    # Landmark file next to a map: MAGIC, landmark count, map width and CRC-32 of
+    # the cells, then the landmark cell ids and one int32 distance array each
+    MAGIC = b"PFL1"
+    HEADER = struct.Struct("<4s3I")
+
+    def __init__(self, map, count=8, landmarks=None, distances=None):
+        self.width = map.width
+        self.checksum = zlib.crc32(bytes(map.cells))
+        # Map version the distances were last checked against, and whether the
+        # walls have changed since they were computed. Stale distances are not
+        # admissible any more, so only the octile distance is used until update()
+        self.version = map.version
+        self.stale = False
+        if landmarks == None:
+            landmarks, distances = LandmarkHeuristic.choose(map, count)
+        self.landmarks = landmarks
+        # Distance from every landmark to every cell, -1 for unreachable cells
+        self.distances = distances
+        # (goal, field) of the last goal looked up, replaced as a whole so
+        # concurrent searches never see the field of another goal. The field is
+        # None until the goal is looked up a second time in a row.
+        self.last_field = None
+
+    @staticmethod
+    def distances_from(map, source):
+        # Breadth-first distances from source over the 8-connected free blocks,
+        # one whole frontier at a time with NumPy when it is installed
+        count = len(map.cells)
+        if numpy != None:
+            free = numpy.frombuffer(bytes(map.cells), dtype=numpy.uint8) != search_map.Map.WALL
+            offsets = numpy.array(map.neighbor_offsets())
+            distances = numpy.full(count, -1, dtype=numpy.int32)
+            distances[source] = 0
+            frontier = numpy.array([source])
+            distance = 0
+            while frontier.size > 0:
+                distance += 1
+                children = (frontier[:, None] + offsets).ravel()
+                children = numpy.unique(children[free[children] & (distances[children] < 0)])
+                distances[children] = distance
+                frontier = children
+            return array.array("i", distances.tobytes())
+        cells = map.cells
+        wall = search_map.Map.WALL
+        offsets = map.neighbor_offsets()
+        distances = array.array("i", [-1]) * count
+        distances[source] = 0
+        frontier = [source]
+        distance = 0
+        while frontier:
+            distance += 1
+            next_frontier = []
+            for cell in frontier:
+                for offset in offsets:
+                    child = cell + offset
+                    if cells[child] != wall and distances[child] == -1:
+                        distances[child] = distance
+                        next_frontier.append(child)
+            frontier = next_frontier
+        return distances
+
+    @staticmethod
+    def choose(map, count):
+        # Farthest-point landmarks: each new landmark is the block farthest from
+        # the ones already chosen, blocks no landmark reaches coming first
+        free = [cell for cell in range(len(map.cells)) if map.cells[cell] != search_map.Map.WALL]
+        landmarks = []
+        distances = []
+        if len(free) == 0:
+            return landmarks, distances
+        # Start from the block farthest from an arbitrary one
+        closest = LandmarkHeuristic.distances_from(map, free[0])
+        unreachable = len(map.cells)
+        for _ in range(min(count, len(free))):
+            best = max(free, key=lambda cell: closest[cell] if closest[cell] >= 0 else unreachable)
+            if best in landmarks:
+                break
+            landmarks.append(best)
+            distances.append(LandmarkHeuristic.distances_from(map, best))
+            if len(landmarks) == 1:
+                closest = array.array("i", distances[0])
+            else:
+                for cell in free:
+                    distance = distances[-1][cell]
+                    if distance >= 0 and (closest[cell] < 0 or distance < closest[cell]):
+                        closest[cell] = distance
+        return landmarks, distances
+
+    def update(self, map):
+        # Landmarks chosen again on the current walls of map
+        landmarks, distances = LandmarkHeuristic.choose(map, len(self.landmarks))
+        self.landmarks = landmarks
+        self.distances = distances
+        self.width = map.width
+        self.checksum = zlib.crc32(bytes(map.cells))
+        self.version = map.version
+        self.last_field = None
+        self.stale = False
+
+    def check(self, map):
+        # Marks the distances stale when the walls of map differ from the ones
+        # they were computed on. Another map with the same walls, as the copy of
+        # a worker process, is accepted.
+        version = map.version
+        if version != self.version:
+            self.stale = map.width != self.width or zlib.crc32(bytes(map.cells)) != self.checksum
+            self.version = version
+        return not self.stale
+
+    def __call__(self, p1, p2):
+        best = Heuristic.octile_distance(p1, p2)
+        if self.stale:
+            return best
+        cell = (p1.x + 1) * self.width + p1.y + 1
+        goal = (p2.x + 1) * self.width + p2.y + 1
+        for distances in self.distances:
+            d1 = distances[cell]
+            d2 = distances[goal]
+            if d1 >= 0 and d2 >= 0 and abs(d1 - d2) > best:
+                best = abs(d1 - d2)
+        return best
+
+    def lookup(self, map, end):
+        # Values for every cell towards end, computed with NumPy once a goal is
+        # searched twice in a row. None otherwise, so searches call the heuristic
+        # on the few blocks they expand instead of filling the whole grid.
+        if not self.check(map) or numpy == None:
+            return None
+        last_field = self.last_field
+        if last_field == None or last_field[0] != (end.x, end.y):
+            self.last_field = ((end.x, end.y), None)
+            return None
+        if last_field[1] != None:
+            return last_field[1]
+        goal = (end.x + 1) * self.width + end.y + 1
+        cells = numpy.arange(len(map.cells))
+        values = numpy.asarray(Heuristic.evaluate(Heuristic.octile_distance, cells // self.width - 1,
+                                                  cells % self.width - 1, end), dtype=numpy.float64)
+        for distances in self.distances:
+            distances = numpy.frombuffer(distances, dtype=numpy.int32)
+            if distances[goal] < 0:
+                continue
+            difference = numpy.abs(distances - distances[goal]).astype(numpy.float64)
+            values = numpy.where(distances >= 0, numpy.maximum(values, difference), values)
+        field = array.array("d", values.tobytes())
+        self.last_field = ((end.x, end.y), field)
+        return field
+
+    def save(self, file_name):
+        with open(file_name, "wb") as file:
+            file.write(LandmarkHeuristic.HEADER.pack(LandmarkHeuristic.MAGIC, len(self.landmarks),
+                                                     self.width, self.checksum))
+            array.array("i", self.landmarks).tofile(file)
+            for distances in self.distances:
+                distances.tofile(file)
+
+    @staticmethod
+    def load(map, file_name):
+        # Landmarks saved for this exact map, None if the file is missing or stale
+        try:
+            with open(file_name, "rb") as file:
+                header = file.read(LandmarkHeuristic.HEADER.size)
+                if len(header) < LandmarkHeuristic.HEADER.size:
+                    return None
+                magic, count, width, checksum = LandmarkHeuristic.HEADER.unpack(header)
+                if (magic != LandmarkHeuristic.MAGIC or width != map.width
+                        or checksum != zlib.crc32(bytes(map.cells))):
+                    return None
+                landmarks = array.array("i")
+                landmarks.fromfile(file, count)
+                distances = []
+                for _ in range(count):
+                    values = array.array("i")
+                    values.fromfile(file, len(map.cells))
+                    distances.append(values)
+        except (FileNotFoundError, EOFError):
+            return None
+        return LandmarkHeuristic(map, count, list(landmarks), distances)
+
+    @staticmethod
+    def for_map_file(map, map_file, count=8):
+        # Landmarks stored next to the map file, built and saved when missing or stale
+        file_name = map_file + ".landmarks"
+        landmarks = LandmarkHeuristic.load(map, file_name)
+        if landmarks == None or len(landmarks.landmarks) < count:
+            landmarks = LandmarkHeuristic(map, count)
+            landmarks.save(file_name)
+        return landmarks
\ No newline at end of file
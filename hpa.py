@@ -0,0 +1,295 @@
+import time
+import heapq
+import astar
+import message
+import search_map
+import utilities
+
+class HierarchicalMap:
+    # HPA* (Botea et al.) on top of a Map. The grid is split into square clusters,
+    # entrances between neighboring clusters become transition blocks of an
+    # abstract graph, and queries are answered on that graph before being refined
+    # into grid paths one segment at a time.
+    #
+    # Inter-cluster edges are built for the whole map up front. Distances inside a
+    # cluster are computed the first time a search needs that cluster and kept
+    # until a wall edit in or next to it invalidates them.
+
+    # Entrances at least this long get a transition at both ends instead of one
+    # in the middle
+    LONG_ENTRANCE = 6
+
+    def __init__(self, map, cluster_size=16):
+        self.map = map
+        # Map version the graph matches, update() brings it up to date
+        self.version = map.version
+        self.cluster_size = cluster_size
+        self.clusters = max(1, -(-map.size // cluster_size))
+        # (cluster, neighbor cluster) -> list of (block, neighbor block) transitions
+        self.borders = {}
+        # Transition block -> {block in the neighbor cluster: 1}
+        self.inter = {}
+        # Cluster -> {transition block: {block of the same cluster: distance}}
+        self.intra = {}
+        for cluster in range(self.clusters * self.clusters):
+            for key in self.cluster_borders(cluster):
+                if key[0] == cluster:
+                    self.build_border(key)
+
+    def cluster_of(self, cell):
+        x, y = divmod(cell, self.map.width)
+        return ((x - 1) // self.cluster_size) * self.clusters + (y - 1) // self.cluster_size
+
+    def bounds(self, cluster):
+        # Padded row and column ranges [x0, x1) and [y0, y1) of a cluster
+        cx, cy = divmod(cluster, self.clusters)
+        x0 = cx * self.cluster_size + 1
+        y0 = cy * self.cluster_size + 1
+        return x0, min(x0 + self.cluster_size, self.map.size + 1), y0, min(y0 + self.cluster_size, self.map.size + 1)
+
+    def cluster_borders(self, cluster):
+        # Keys of every border (orthogonal and corner) the cluster takes part in
+        cx, cy = divmod(cluster, self.clusters)
+        keys = []
+        for dx, dy in ((0, 1), (1, 0), (1, 1), (1, -1), (0, -1), (-1, 0), (-1, -1), (-1, 1)):
+            nx = cx + dx
+            ny = cy + dy
+            if nx < 0 or ny < 0 or nx >= self.clusters or ny >= self.clusters:
+                continue
+            other = nx * self.clusters + ny
+            keys.append((min(cluster, other), max(cluster, other)))
+        return keys
+
+    def build_border(self, key):
+        # Find the transitions between two neighboring clusters, key[0] < key[1]
+        for cell, other in self.borders.get(key, []):
+            del self.inter[cell][other]
+            del self.inter[other][cell]
+        cells = self.map.cells
+        width = self.map.width
+        wall = search_map.Map.WALL
+        x0, x1, y0, y1 = self.bounds(key[0])
+        dx = key[1] // self.clusters - key[0] // self.clusters
+        dy = key[1] % self.clusters - key[0] % self.clusters
+        pairs = []
+        if dx == 0 or dy == 0:
+            # Orthogonal border: walk along the last row or column of the first cluster
+            if dx == 0:
+                first, along, across, length = x0 * width + y1 - 1, width, 1, x1 - x0
+            else:
+                first, along, across, length = (x1 - 1) * width + y0, 1, width, y1 - y0
+            run = []
+            for i in range(length + 1):
+                cell = first + i * along
+                if i < length and cells[cell] != wall and cells[cell + across] != wall:
+                    run.append(cell)
+                    continue
+                if len(run) >= HierarchicalMap.LONG_ENTRANCE:
+                    pairs.append((run[0], run[0] + across))
+                    pairs.append((run[-1], run[-1] + across))
+                elif len(run) > 0:
+                    middle = run[len(run) // 2]
+                    pairs.append((middle, middle + across))
+                run = []
+            # Diagonal crossings with no orthogonal way around them
+            for i in range(length - 1):
+                cell = first + i * along
+                for a, b in ((cell, cell + along + across), (cell + along, cell + across)):
+                    if (cells[a] != wall and cells[b] != wall
+                            and cells[a + across] == wall and cells[b - across] == wall):
+                        pairs.append((a, b))
+        else:
+            # Corner border, crossed only by a diagonal move between the corner blocks
+            if dy > 0:
+                cell = (x1 - 1) * width + y1 - 1
+            else:
+                cell = (x1 - 1) * width + y0
+            other = cell + width + dy
+            if (cells[cell] != wall and cells[other] != wall
+                    and cells[cell + width] == wall and cells[cell + dy] == wall):
+                pairs.append((cell, other))
+        self.borders[key] = pairs
+        for cell, other in pairs:
+            self.inter.setdefault(cell, {})[other] = 1
+            self.inter.setdefault(other, {})[cell] = 1
+
+    def transitions(self, cluster):
+        result = set()
+        for key in self.cluster_borders(cluster):
+            for cell, other in self.borders.get(key, []):
+                result.add(cell if key[0] == cluster else other)
+        return result
+
+    def cluster_search(self, cluster, source, target=-1):
+        # Breadth-first search from source restricted to one cluster, stopping at
+        # target when given. Returns distances and parents by block.
+        x0, x1, y0, y1 = self.bounds(cluster)
+        cells = self.map.cells
+        width = self.map.width
+        wall = search_map.Map.WALL
+        offsets = self.map.neighbor_offsets()
+        low = x0 * width
+        high = x1 * width
+        distances = {source: 0}
+        parents = {source: -1}
+        frontier = [source]
+        while frontier and target not in distances:
+            next_frontier = []
+            for cell in frontier:
+                distance = distances[cell] + 1
+                for offset in offsets:
+                    child = cell + offset
+                    if cells[child] == wall or child in distances:
+                        continue
+                    if child < low or child >= high or not y0 <= child % width < y1:
+                        continue
+                    distances[child] = distance
+                    parents[child] = cell
+                    next_frontier.append(child)
+            frontier = next_frontier
+        return distances, parents
+
+    def intra_edges(self, cluster):
+        edges = self.intra.get(cluster)
+        if edges == None:
+            edges = {}
+            transitions = self.transitions(cluster)
+            for cell in transitions:
+                distances, _ = self.cluster_search(cluster, cell)
+                edges[cell] = {other: distances[other] for other in transitions
+                               if other != cell and other in distances}
+            self.intra[cluster] = edges
+        return edges
+
+    def precompute(self):
+        # Fill the distances of every cluster now instead of on first use
+        for cluster in range(self.clusters * self.clusters):
+            self.intra_edges(cluster)
+
+    def update(self, positions):
+        # Rebuild what wall edits at positions (x, y pairs) can change: borders
+        # around the edited blocks and the distances of the clusters they touch
+        width = self.map.width
+        clusters = set()
+        for x, y in positions:
+            cell = self.map.cell_id(x, y)
+            for offset in [0] + self.map.neighbor_offsets():
+                nx, ny = divmod(cell + offset, width)
+                if 1 <= nx <= self.map.size and 1 <= ny <= self.map.size:
+                    clusters.add(self.cluster_of(cell + offset))
+        keys = set()
+        for cluster in clusters:
+            keys.update(self.cluster_borders(cluster))
+        for key in keys:
+            self.build_border(key)
+            clusters.update(key)
+        for cluster in clusters:
+            self.intra.pop(cluster, None)
+        self.version = self.map.version
+
+    def abstract_search(self, heuristic, epsilon=1, deadline=None):
+        # A* on the abstract graph, with start and end linked to the transitions of
+        # their clusters. Returns the abstract path (empty if none), stats and
+        # whether the deadline stopped it.
+        map = self.map
+        stats = utilities.SearchStats()
+        if (not map.is_valid(map.start.x, map.start.y) or not map.is_valid(map.end.x, map.end.y)
+                or map.is_wall(map.start.x, map.start.y) or map.is_wall(map.end.x, map.end.y)):
+            return [], stats, False
+        start_cell = map.cell_id(map.start.x, map.start.y)
+        end_cell = map.cell_id(map.end.x, map.end.y)
+        width = map.width
+        start_cluster = self.cluster_of(start_cell)
+        end_cluster = self.cluster_of(end_cell)
+
+        # Temporary edges of start and end
+        distances, _ = self.cluster_search(start_cluster, start_cell)
+        start_edges = {cell: distances[cell] for cell in self.transitions(start_cluster) if cell in distances}
+        if start_cluster == end_cluster and end_cell in distances:
+            start_edges[end_cell] = distances[end_cell]
+        distances, _ = self.cluster_search(end_cluster, end_cell)
+        end_edges = {cell: distances[cell] for cell in self.transitions(end_cluster) if cell in distances}
+
+        probe = search_map.Position()
+        g_values = {start_cell: 0}
+        parents = {start_cell: -1}
+        closed = set()
+        queue = [(heuristic(map.start, map.end), 0, start_cell)]
+        stats.pushes = 1
+        timed_out = False
+        path = []
+        while queue:
+            _, g_key, cell = heapq.heappop(queue)
+            if cell in closed or -g_key > g_values[cell]:
+                stats.duplicate_pops += 1
+                continue
+            closed.add(cell)
+            stats.expanded += 1
+            if deadline != None and time.perf_counter() >= deadline:
+                timed_out = True
+                break
+            if cell == end_cell:
+                path = astar.AStar.build_path(parents, end_cell)
+                stats.path_cost = g_values[end_cell]
+                break
+
+            neighbors = []
+            if cell == start_cell:
+                neighbors.extend(start_edges.items())
+            if cell in self.inter:
+                neighbors.extend(self.inter[cell].items())
+                neighbors.extend(self.intra_edges(self.cluster_of(cell)).get(cell, {}).items())
+            if cell in end_edges:
+                neighbors.append((end_cell, end_edges[cell]))
+            for child, cost in neighbors:
+                if child in closed:
+                    continue
+                g_value = g_values[cell] + cost
+                if child in g_values and g_values[child] <= g_value:
+                    continue
+                g_values[child] = g_value
+                parents[child] = cell
+                probe.x = child // width - 1
+                probe.y = child % width - 1
+                heapq.heappush(queue, (g_value + heuristic(probe, map.end) * epsilon, -g_value, child))
+                stats.pushes += 1
+                stats.peak_open = max(stats.peak_open, len(queue))
+        return path, stats, timed_out
+
+    def refine(self, abstract_path):
+        # Yield the grid path one abstract edge at a time, so a caller only pays
+        # for the part of the path it actually walks
+        if len(abstract_path) == 0:
+            return
+        yield abstract_path[0]
+        for cell, next_cell in zip(abstract_path, abstract_path[1:]):
+            if next_cell in self.inter.get(cell, {}):
+                yield next_cell
+                continue
+            _, parents = self.cluster_search(self.cluster_of(cell), cell, next_cell)
+            segment = []
+            while next_cell != cell:
+                segment.append(next_cell)
+                next_cell = parents[next_cell]
+            segment.reverse()
+            for segment_cell in segment:
+                yield segment_cell
+
+
+class HPA:
+    # Engine with the interface of AStar.search_map. A given hierarchy is used
+    # when it matches the map version, otherwise the one kept for the map, which
+    # is built again once the walls change without update().
+    hierarchies = utilities.MapCache(HierarchicalMap)
+
+    @staticmethod
+    @utilities.timer
+    def search_map(map, heuristic, epsilon=1, message_queue=None, deadline=None, buffers=None, hierarchy=None):
+        if hierarchy == None or hierarchy.map is not map or hierarchy.version != map.version:
+            hierarchy = HPA.hierarchies.get(map)
+        if message_queue != None:
+            message_queue.put_nowait(message.Message(action="LOCK"))
+            message_queue.put_nowait(message.Message(action="CLEAR"))
+        abstract_path, stats, timed_out = hierarchy.abstract_search(heuristic, epsilon, deadline)
+        path = list(hierarchy.refine(abstract_path))
+        return astar.SearchResult(map, path, len(path) > 0, stats, timed_out)
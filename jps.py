@@ -0,0 +1,308 @@
+import time
+import heapq
+import astar
+import grid
+import message
+import search_map
+import utilities
+
+class JumpTable:
+    # JPS+ distances: for every cell and each of the 8 directions, d > 0 means the
+    # next jump point is d steps away, d <= 0 means there are -d free steps before
+    # a wall. Built once per map, the search then never scans the grid. Wall
+    # edits make a table stale, it only fits the map version it was built on.
+    def __init__(self, map):
+        self.width = map.width
+        self.size = len(map.cells)
+        self.version = map.version
+        # One distance buffer per direction of JPS.DIRECTIONS, straight ones
+        # first since the diagonal ones depend on them
+        self.distances = [None] * 8
+        for index, (dx, dy) in enumerate(JPS.DIRECTIONS):
+            if dx == 0 or dy == 0:
+                self.distances[index] = self.build(map, dx, dy, JPS.straight_forced)
+        for index, (dx, dy) in enumerate(JPS.DIRECTIONS):
+            if dx != 0 and dy != 0:
+                self.distances[index] = self.build(map, dx, dy, self.diagonal_jump_point)
+
+    def diagonal_jump_point(self, cells, cell, dx, dy, width):
+        # A cell reached diagonally is a jump point when it has a forced neighbor
+        # or a straight jump point ahead in one of the two straight directions
+        if JPS.diagonal_forced(cells, cell, dx, dy, width):
+            return True
+        return (self.distances[JPS.direction_index(dx, 0)][cell] > 0
+                or self.distances[JPS.direction_index(0, dy)][cell] > 0)
+
+    def build(self, map, dx, dy, is_jump_point):
+        width = map.width
+        cells = map.cells
+        wall = search_map.Map.WALL
+        offset = dx * width + dy
+        distances = [0] * len(cells)
+        # Visit cells so that the next cell in the direction is always done first
+        rows = range(map.size, 0, -1) if dx > 0 else range(1, map.size + 1)
+        cols = range(map.size, 0, -1) if dy > 0 else range(1, map.size + 1)
+        for x in rows:
+            for y in cols:
+                cell = x * width + y
+                if cells[cell] == wall:
+                    continue
+                next_cell = cell + offset
+                if cells[next_cell] == wall:
+                    distances[cell] = 0
+                elif is_jump_point(cells, next_cell, dx, dy, width):
+                    distances[cell] = 1
+                elif distances[next_cell] > 0:
+                    distances[cell] = distances[next_cell] + 1
+                else:
+                    distances[cell] = distances[next_cell] - 1
+        return distances
+
+    def fits(self, map):
+        return map.width == self.width and len(map.cells) == self.size and map.version == self.version
+
+
+class JPS:
+    # Jump Point Search (Harabor and Grastien) on the 8-connected unit-cost grid
+    # used by AStar. Diagonal moves may cut corners, as they do in AStar.
+
+    # Number of expansions between two deadline checks
+    CHECK_EVERY = 256
+    # Same order as the (dx, dy) moves of AStar
+    DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+
+    @staticmethod
+    def direction_index(dx, dy):
+        return JPS.DIRECTIONS.index((dx, dy))
+
+    @staticmethod
+    def straight_forced(cells, cell, dx, dy, width):
+        # Moving straight, a wall beside the cell with a free cell past it
+        wall = search_map.Map.WALL
+        offset = dx * width + dy
+        side = 1 if dx != 0 else width
+        return ((cells[cell + side] == wall and cells[cell + side + offset] != wall)
+                or (cells[cell - side] == wall and cells[cell - side + offset] != wall))
+
+    @staticmethod
+    def diagonal_forced(cells, cell, dx, dy, width):
+        wall = search_map.Map.WALL
+        offset_x = dx * width
+        return ((cells[cell - offset_x] == wall and cells[cell - offset_x + dy] != wall)
+                or (cells[cell - dy] == wall and cells[cell - dy + offset_x] != wall))
+
+    @staticmethod
+    def jump_straight(cells, cell, dx, dy, width, end_cell):
+        wall = search_map.Map.WALL
+        offset = dx * width + dy
+        side = 1 if dx != 0 else width
+        while True:
+            cell += offset
+            if cells[cell] == wall:
+                return -1
+            if cell == end_cell:
+                return cell
+            if ((cells[cell + side] == wall and cells[cell + side + offset] != wall)
+                    or (cells[cell - side] == wall and cells[cell - side + offset] != wall)):
+                return cell
+
+    @staticmethod
+    def jump(cells, cell, dx, dy, width, end_cell):
+        # Next jump point from cell in direction (dx, dy), -1 if there is none
+        if dx == 0 or dy == 0:
+            return JPS.jump_straight(cells, cell, dx, dy, width, end_cell)
+        wall = search_map.Map.WALL
+        offset = dx * width + dy
+        while True:
+            cell += offset
+            if cells[cell] == wall:
+                return -1
+            if cell == end_cell or JPS.diagonal_forced(cells, cell, dx, dy, width):
+                return cell
+            if (JPS.jump_straight(cells, cell, dx, 0, width, end_cell) != -1
+                    or JPS.jump_straight(cells, cell, 0, dy, width, end_cell) != -1):
+                return cell
+
+    @staticmethod
+    def pruned_directions(cells, cell, parent, width):
+        # Natural and forced directions when reaching cell from parent
+        if parent == -1:
+            return JPS.DIRECTIONS
+        x, y = divmod(cell, width)
+        px, py = divmod(parent, width)
+        dx = (x > px) - (x < px)
+        dy = (y > py) - (y < py)
+        wall = search_map.Map.WALL
+        if dx != 0 and dy != 0:
+            result = [(dx, 0), (0, dy), (dx, dy)]
+            if cells[cell - dx * width] == wall:
+                result.append((-dx, dy))
+            if cells[cell - dy] == wall:
+                result.append((dx, -dy))
+            return result
+        result = [(dx, dy)]
+        if dx != 0:
+            if cells[cell + 1] == wall:
+                result.append((dx, 1))
+            if cells[cell - 1] == wall:
+                result.append((dx, -1))
+        else:
+            if cells[cell + width] == wall:
+                result.append((1, dy))
+            if cells[cell - width] == wall:
+                result.append((-1, dy))
+        return result
+
+    @staticmethod
+    def table_successor(table, cell, dx, dy, width, end_cell):
+        # JPS+ successor in direction (dx, dy), with the end as a target jump point
+        # when it lies on the way
+        distance = table.distances[JPS.direction_index(dx, dy)][cell]
+        reach = distance if distance > 0 else -distance
+        if end_cell != -1:
+            x, y = divmod(cell, width)
+            ex, ey = divmod(end_cell, width)
+            if dx == 0 or dy == 0:
+                steps = abs(ex - x) + abs(ey - y)
+                if ((dx == 0 and ex == x and (ey - y) * dy > 0)
+                        or (dy == 0 and ey == y and (ex - x) * dx > 0)) and steps <= reach:
+                    return end_cell
+            elif (ex - x) * dx > 0 and (ey - y) * dy > 0:
+                steps = min(abs(ex - x), abs(ey - y))
+                if steps <= reach:
+                    return cell + steps * (dx * width + dy)
+        if distance > 0:
+            return cell + distance * (dx * width + dy)
+        return -1
+
+    @staticmethod
+    def expand_path(jump_points, width):
+        # Fill the straight and diagonal segments between jump points
+        if len(jump_points) == 0:
+            return []
+        path = [jump_points[0]]
+        for cell in jump_points[1:]:
+            x, y = divmod(path[-1], width)
+            nx, ny = divmod(cell, width)
+            step = ((nx > x) - (nx < x)) * width + (ny > y) - (ny < y)
+            current = path[-1]
+            while current != cell:
+                current += step
+                path.append(current)
+        return path
+
+    @staticmethod
+    @utilities.timer
+    def search_map(map, heuristic, epsilon=1, message_queue=None, deadline=None, buffers=None, jump_table=None):
+        # Same interface and result as AStar.search_map, jump_table switches to JPS+
+        cells = map.cells
+        width = map.width
+        if buffers == None or not buffers.fits(map):
+            buffers = astar.SearchBuffers(map)
+        if jump_table != None and not jump_table.fits(map):
+            jump_table = None
+        generation = buffers.next_generation()
+        seen = generation * 2
+        closed = seen + 1
+        stamps = buffers.stamps
+        g_values = buffers.g_values
+        parents = buffers.parents
+        start_cell = map.cell_id(map.start.x, map.start.y)
+        end_cell = map.cell_id(map.end.x, map.end.y)
+        if not map.is_valid(map.end.x, map.end.y):
+            end_cell = -1
+        probe = search_map.Position()
+        end = map.end
+        field = None
+        if hasattr(heuristic, "lookup"):
+            field = heuristic.lookup(map, end)
+
+        path_found = False
+        path = []
+        expanded = 0
+        pushes = 0
+        duplicate_pops = 0
+        peak_open = 0
+        timed_out = False
+        check_every = JPS.CHECK_EVERY
+        queue = []
+        events = message.EventQueue.wrap(message_queue, width)
+        if events != None:
+            events.put_nowait(message.Message(action="LOCK"))
+            events.put_nowait(message.Message(action="CLEAR"))
+        if map.is_valid(map.start.x, map.start.y) and not map.is_wall(map.start.x, map.start.y):
+            stamps[start_cell] = seen
+            g_values[start_cell] = 0
+            parents[start_cell] = -1
+            queue.append((heuristic(map.start, end), 0, start_cell))
+            pushes += 1
+            peak_open = 1
+        while queue:
+            _, g_key, cell = heapq.heappop(queue)
+            if stamps[cell] == closed or -g_key > g_values[cell]:
+                duplicate_pops += 1
+                continue
+            stamps[cell] = closed
+            expanded += 1
+            if deadline != None and expanded % check_every == 0 and time.perf_counter() >= deadline:
+                timed_out = True
+                break
+
+            # Request drawing
+            if events != None:
+                events.push(cell, grid.Grid.POP_ID)
+
+            if cell == end_cell:
+                path_found = True
+                break
+
+            x, y = divmod(cell, width)
+            for dx, dy in JPS.pruned_directions(cells, cell, parents[cell], width):
+                if jump_table != None:
+                    child = JPS.table_successor(jump_table, cell, dx, dy, width, end_cell)
+                else:
+                    child = JPS.jump(cells, cell, dx, dy, width, end_cell)
+                if child == -1 or stamps[child] == closed:
+                    continue
+                cx, cy = divmod(child, width)
+                g_value = g_values[cell] + max(abs(cx - x), abs(cy - y))
+                if stamps[child] == seen and g_values[child] <= g_value:
+                    continue
+
+                stamps[child] = seen
+                g_values[child] = g_value
+                parents[child] = cell
+                if field != None:
+                    h_value = field[child]
+                else:
+                    probe.x = cx - 1
+                    probe.y = cy - 1
+                    h_value = heuristic(probe, end)
+                heapq.heappush(queue, (g_value + h_value * epsilon, -g_value, child))
+                pushes += 1
+                if len(queue) > peak_open:
+                    peak_open = len(queue)
+
+                # Request drawing
+                if events != None:
+                    events.push(child, grid.Grid.IN_QUEUE_ID)
+
+        if events != None:
+            events.flush()
+        stats = utilities.SearchStats(expanded, pushes, duplicate_pops, peak_open)
+        if path_found:
+            path = JPS.expand_path(astar.AStar.build_path(parents, end_cell), width)
+            stats.path_cost = g_values[end_cell]
+        return astar.SearchResult(map, path, path_found, stats, timed_out)
+
+
+class JPSPlus:
+    # JPS with jump distances precomputed in a JumpTable, the tables of the last
+    # maps searched are kept until their walls change
+    tables = utilities.MapCache(JumpTable)
+
+    @staticmethod
+    def search_map(map, heuristic, epsilon=1, message_queue=None, deadline=None, buffers=None, jump_table=None):
+        if jump_table == None or not jump_table.fits(map):
+            jump_table = JPSPlus.tables.get(map)
+        return JPS.search_map(map, heuristic, epsilon, message_queue, deadline, buffers, jump_table)
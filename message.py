@@ -1,6 +1,108 @@
+import time
+import array
+import queue
+
 class Message:
     def __init__(self, x=0, y=0, action=None, param=None):
         self.x = x
         self.y = y
         self.action = action
-        self.param = param
\ No newline at end of file
+        self.param = param
+
+
+class EventQueue:
+    # Drawing events of a search, collected in compact arrays and sent as one
+    # "BATCH" message (param is (width, cell ids, grid values)) once batch_size
+    # events are waiting or interval seconds have passed. Other messages go
+    # through put_nowait() after the pending batch, so the order is kept.
+    # Batches wait for room in a bounded queue, so a search cannot run away from
+    # the window drawing it, unless drop_batches is set (searches on a time
+    # budget) and then batches of search progress that do not fit are dropped.
+    # Events pushed with keep (the found path) are never sampled nor dropped,
+    # they go in batches of their own that wait for room. Waiting stops for
+    # good once cancel() is called, e.g. by a window being closed, and nothing
+    # is sent afterwards. Searches without a queue never create one.
+    # A configured EventQueue can be passed to a search in place of a queue.
+
+    # Events between two interval checks
+    CHECK_EVERY = 16
+    # Seconds between two checks of cancel() while waiting for room
+    PUT_TIMEOUT = 0.1
+
+    def __init__(self, queue, width=0, batch_size=256, interval=1 / 60, sample=1, drop_batches=False):
+        self.queue = queue
+        self.width = width
+        self.batch_size = batch_size
+        self.interval = interval
+        # Keep one drawing event out of sample
+        self.sample = sample
+        self.drop_batches = drop_batches
+        self.dropped = 0
+        # The pending events were pushed with keep
+        self.keep = False
+        self.cancelled = False
+        self.count = 0
+        self.cells = array.array("i")
+        self.values = array.array("b")
+        self.last_flush = time.perf_counter()
+
+    @staticmethod
+    def wrap(queue, width):
+        # EventQueue for a search on a map of the given width, None without a queue
+        if queue == None:
+            return None
+        if isinstance(queue, EventQueue):
+            queue.flush()
+            queue.width = width
+            return queue
+        return EventQueue(queue, width)
+
+    def push(self, cell, value, keep=False):
+        if self.cancelled:
+            return
+        if keep != self.keep:
+            self.flush()
+            self.keep = keep
+        if self.sample > 1 and not keep:
+            self.count += 1
+            if self.count % self.sample != 0:
+                return
+        self.cells.append(cell)
+        self.values.append(value)
+        size = len(self.cells)
+        if size >= self.batch_size:
+            self.flush()
+        elif size % EventQueue.CHECK_EVERY == 0 and time.perf_counter() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.perf_counter()
+        if len(self.cells) == 0:
+            return
+        batch = Message(action="BATCH", param=(self.width, self.cells, self.values))
+        self.cells = array.array("i")
+        self.values = array.array("b")
+        if not self.drop_batches or self.keep:
+            self.put(batch)
+            return
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            self.dropped += 1
+
+    def put(self, message):
+        # Wait for room until the queue is cancelled
+        while not self.cancelled:
+            try:
+                self.queue.put(message, timeout=EventQueue.PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def put_nowait(self, message):
+        self.flush()
+        self.put(message)
+
+    def cancel(self):
+        # Stop waiting for the reader and drop everything from now on
+        self.cancelled = True
\ No newline at end of file
@@ -0,0 +1,206 @@
+import heapq
+import functools
+
+# Priority queues of the searches. Every backend has push(entry), pop() and
+# size(), the number of queued entries. Entries are tuples: entry[0] is the
+# key and entry[-1] the item, the entry with the smallest key comes out
+# first. Backends compare whole entries on equal keys, except the integer
+# ones which pop the last pushed entry first. Pushing an item already queued
+# replaces its entry when the new one is smaller on backends with
+# DECREASE_KEY, others keep both and the larger one comes out later, so
+# searches skip items they have already expanded. Backends with INTEGER_KEYS
+# only take non negative int keys.
+
+class HeapQueue:
+    # Binary heap, push and pop are heapq itself on the entry list
+    DECREASE_KEY = False
+    INTEGER_KEYS = False
+
+    def __init__(self):
+        self.entries = []
+        self.push = functools.partial(heapq.heappush, self.entries)
+        self.pop = functools.partial(heapq.heappop, self.entries)
+        self.size = self.entries.__len__
+
+
+class PairingNode:
+    __slots__ = ("entry", "child", "sibling", "previous")
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.child = None
+        self.sibling = None
+        # Parent for a first child, left sibling otherwise
+        self.previous = None
+
+
+class PairingHeap:
+    # Pairing heap with decrease-key: every item is queued at most once, so
+    # nothing stale is popped. Push and decrease-key are O(1), pop is
+    # O(log n) amortized.
+    DECREASE_KEY = True
+    INTEGER_KEYS = False
+
+    def __init__(self):
+        self.root = None
+        self.nodes = {}
+
+    @staticmethod
+    def link(first, second):
+        # Root of the two trees, the other one becomes its first child
+        if second.entry < first.entry:
+            first, second = second, first
+        child = first.child
+        second.previous = first
+        second.sibling = child
+        if child != None:
+            child.previous = second
+        first.child = second
+        return first
+
+    def push(self, entry):
+        node = self.nodes.get(entry[-1])
+        if node == None:
+            node = PairingNode(entry)
+            self.nodes[entry[-1]] = node
+            self.root = node if self.root == None else PairingHeap.link(self.root, node)
+        elif entry < node.entry:
+            self.decrease(node, entry)
+
+    def decrease(self, node, entry):
+        node.entry = entry
+        if node is self.root:
+            return
+        # Cut the subtree of node and link it back to the root
+        previous = node.previous
+        if previous.child is node:
+            previous.child = node.sibling
+        else:
+            previous.sibling = node.sibling
+        if node.sibling != None:
+            node.sibling.previous = previous
+        node.sibling = None
+        node.previous = None
+        self.root = PairingHeap.link(self.root, node)
+
+    def pop(self):
+        root = self.root
+        if root == None:
+            raise IndexError("pop from an empty pairing heap")
+        del self.nodes[root.entry[-1]]
+        # Two-pass pairing: link the children two by two from the left, then
+        # the pairs into one tree from the right
+        pairs = []
+        node = root.child
+        while node != None:
+            second = node.sibling
+            if second == None:
+                node.previous = None
+                pairs.append(node)
+                break
+            following = second.sibling
+            node.sibling = node.previous = None
+            second.sibling = second.previous = None
+            pairs.append(PairingHeap.link(node, second))
+            node = following
+        tree = None
+        for node in reversed(pairs):
+            tree = node if tree == None else PairingHeap.link(node, tree)
+        self.root = tree
+        return root.entry
+
+    def size(self):
+        return len(self.nodes)
+
+
+class BucketQueue:
+    # Dial's bucket queue: one list per key and a cursor on the smallest non
+    # empty one. Push is O(1), pop scans the empty buckets up to the next key,
+    # so it suits keys within a small range such as the f values of unit cost
+    # grids. Keys below the cursor move it back.
+    DECREASE_KEY = False
+    INTEGER_KEYS = True
+
+    def __init__(self):
+        self.buckets = []
+        self.cursor = 0
+        self.count = 0
+
+    def push(self, entry):
+        key = entry[0]
+        buckets = self.buckets
+        while key >= len(buckets):
+            buckets.append([])
+        buckets[key].append(entry)
+        if key < self.cursor:
+            self.cursor = key
+        self.count += 1
+
+    def pop(self):
+        if self.count == 0:
+            raise IndexError("pop from an empty bucket queue")
+        buckets = self.buckets
+        cursor = self.cursor
+        while not buckets[cursor]:
+            cursor += 1
+        self.cursor = cursor
+        self.count -= 1
+        return buckets[cursor].pop()
+
+    def size(self):
+        return self.count
+
+
+class RadixQueue:
+    # Radix heap for keys that never go below the last popped key, as the f
+    # values of an A* search with a consistent heuristic. Bucket i holds the
+    # keys whose highest bit differing from the last popped key is bit i - 1,
+    # so a push is O(1) and every entry moves down at most once per bit of the
+    # key range, whatever the range. Smaller keys come out as if they were the
+    # last popped key.
+    DECREASE_KEY = False
+    INTEGER_KEYS = True
+
+    def __init__(self):
+        self.last = 0
+        self.count = 0
+        self.buckets = [[]]
+
+    def push(self, entry):
+        key = entry[0]
+        index = (key ^ self.last).bit_length() if key > self.last else 0
+        while index >= len(self.buckets):
+            self.buckets.append([])
+        self.buckets[index].append(entry)
+        self.count += 1
+
+    def pop(self):
+        if self.count == 0:
+            raise IndexError("pop from an empty radix queue")
+        buckets = self.buckets
+        if not buckets[0]:
+            index = 1
+            while not buckets[index]:
+                index += 1
+            # Entries of the first non empty bucket spread over lower buckets
+            # around their smallest key
+            bucket = buckets[index]
+            buckets[index] = []
+            last = min(entry[0] for entry in bucket)
+            self.last = last
+            for entry in bucket:
+                buckets[(entry[0] ^ last).bit_length()].append(entry)
+        self.count -= 1
+        return buckets[0].pop()
+
+    def size(self):
+        return self.count
+
+
+# Backends by command line name
+BACKENDS = {
+    "heap": HeapQueue,
+    "pairing": PairingHeap,
+    "bucket": BucketQueue,
+    "radix": RadixQueue,
+}
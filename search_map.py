@@ -1,3 +1,10 @@
+import sys
+import mmap
+import weakref
+import array
+import struct
+import itertools
+
 class Position:
     def __init__(self, x=0, y=0):
         self.x = x
@@ -7,20 +14,178 @@ class Position:
         return self.x == other.x and self.y == other.y
 
 
+class MapRow:
+    # A row of the map seen as a list, reading and writing the flat cell buffer
+    def __init__(self, cells, offset, size, owner=None):
+        self.cells = cells
+        self.offset = offset
+        self.size = size
+        # Map told about writes, held weakly so a map and its rows are no
+        # reference cycle and go as soon as the map is dropped (views on shared
+        # memory must be released before the segment is closed)
+        self.owner = weakref.ref(owner) if owner != None else None
+
+    def index(self, y):
+        if y < 0:
+            y += self.size
+        if y < 0 or y >= self.size:
+            raise IndexError("map row index out of range")
+        return self.offset + y
+
+    def __getitem__(self, y):
+        if isinstance(y, slice):
+            return list(self)[y]
+        return self.cells[self.index(y)]
+
+    def __setitem__(self, y, value):
+        self.cells[self.index(y)] = value
+        owner = self.owner() if self.owner != None else None
+        if owner != None:
+            owner.changed()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.cells[self.offset:self.offset + self.size])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class Map:
+    # The map is stored in a flat bytearray with a one-cell wall border around it.
+    # Cell (x, y) has id (x + 1) * width + (y + 1), so the 8 neighbors of any cell
+    # are always inside the buffer and searches need no bounds checks.
+    # `map` still exposes the grid as a list of rows backed by the same buffer.
+    WALL = 1
+    # Versions are unique across maps, so (version, ...) keys never collide
+    versions = itertools.count(1)
+
     def __init__(self):
         self.size = 0
-        self.map = []
+        self.width = 2
+        self.cells = bytearray([Map.WALL]) * 4
+        self.rows = []
+        # Cost of entering each block (array of uint8 or uint16 by cell id), None
+        # when every free block costs 1
+        self.costs = None
+        # mmap backing cells when loaded from a binary file
+        self.mapping = None
+        # Changes on every write through `map`, code writing cells directly calls changed()
+        self.version = next(Map.versions)
         self.start = Position()
         self.end = Position()
 
+    @property
+    def map(self):
+        return self.rows
+
+    @map.setter
+    def map(self, matrix):
+        self.resize(len(matrix))
+        for x in range(self.size):
+            offset = (x + 1) * self.width + 1
+            self.cells[offset:offset + self.size] = bytes(matrix[x])
+        self.changed()
+
+    def resize(self, size, default_value=0):
+        width = size + 2
+        cells = bytearray([Map.WALL]) * (width * width)
+        row = bytes([default_value]) * size
+        for x in range(size):
+            offset = (x + 1) * width + 1
+            cells[offset:offset + size] = row
+        self.use_buffer(cells, size)
+
+    def use_buffer(self, cells, size):
+        # Use an existing padded cell buffer (bytearray, memoryview, ...) without copying it
+        self.size = size
+        self.width = size + 2
+        self.cells = cells
+        self.costs = None
+        self.rows = [MapRow(self.cells, (x + 1) * self.width + 1, size, self) for x in range(size)]
+        self.changed()
+
+    def changed(self):
+        self.version = next(Map.versions)
+
+    # Largest cost of a block, costs are stored as uint8 when they fit
+    MAX_COST = 0xffff
+
+    @staticmethod
+    def cost_buffer(values):
+        # uint8 or uint16 array of costs, every cost must be from 1 to MAX_COST
+        if len(values) > 0 and (min(values) < 1 or max(values) > Map.MAX_COST):
+            raise Exception("Cost of a block must be from 1 to {}".format(Map.MAX_COST))
+        return array.array("B" if len(values) == 0 or max(values) <= 0xff else "H", values)
+
+    def set_costs(self, matrix):
+        # Costs as a list of rows like `map`, None to go back to unit costs
+        if matrix == None:
+            self.costs = None
+            self.changed()
+            return
+        if len(matrix) != self.size or any(len(row) != self.size for row in matrix):
+            raise Exception("Costs must have {} rows of {} values".format(self.size, self.size))
+        self.use_costs([cost for row in matrix for cost in row])
+
+    def use_costs(self, values):
+        # Costs of every block, row after row, padded like the cells
+        values = Map.cost_buffer(values)
+        costs = array.array(values.typecode, [1]) * len(self.cells)
+        for x in range(self.size):
+            offset = (x + 1) * self.width + 1
+            costs[offset:offset + self.size] = values[x * self.size:(x + 1) * self.size]
+        self.costs = costs
+        self.changed()
+
+    def cost(self, x, y):
+        if self.costs == None:
+            return 1
+        return self.costs[(x + 1) * self.width + y + 1]
+
+    def min_cost(self):
+        # Cheapest block, walls included so it is a row minimum, what admissible
+        # heuristics are scaled by
+        if self.costs == None or self.size == 0:
+            return 1
+        return min(min(self.costs[(x + 1) * self.width + 1:(x + 2) * self.width - 1]) for x in range(self.size))
+
+    # Binary map file: MAGIC, then size, start x, start y, end x, end y as
+    # little-endian uint32, then the padded cell buffer with one byte per cell,
+    # so a file can back the map as is. A cost layer follows at the next
+    # multiple of 4: COSTS_MAGIC, the bytes per cost as uint32, then the padded
+    # little-endian costs.
+    MAGIC = b"PFM1"
+    HEADER = struct.Struct("<4s5I")
+    COSTS_MAGIC = b"COST"
+    COSTS_HEADER = struct.Struct("<4sI")
+    # Token starting the cost layer of text maps
+    COSTS_TOKEN = "costs"
+    # Text digits of block values and back
+    DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+    VALUES = bytes.maketrans(b"01", b"\x00\x01")
+
+    @staticmethod
+    def costs_offset(end):
+        # Start of the cost layer in a binary file whose cells end at end
+        return (end + 3) // 4 * 4
+
     def read_from_file(self, file_name):
         try:
+            with open(file_name, "rb") as file:
+                binary = file.read(len(Map.MAGIC)) == Map.MAGIC
+            if binary:
+                return self.read_binary(file_name)
             with open(file_name, "r") as file:
                 try:
                     # Read all data
                     data = file.read().strip().split()
-                    self.size = int(data[0])
+                    self.resize(int(data[0]))
 
                     # Read start point position
                     self.start.x = int(data[1])
@@ -30,17 +195,28 @@ class Map:
                     self.end.x = int(data[3])
                     self.end.y = int(data[4])
 
-                    # Read map data
+                    # Read map data, one digit per token is converted in one pass
                     data = data[5:]
-                    for x in range(0, self.size):
-                        for y in range(0, self.size):
-                            if y == 0:
-                                self.map.append([])
-                            block = int(data[x * self.size + y])
-                            if block < 0 or block > 1:
-                                raise Exception(
-                                    "Value in map must be either 0 or 1")
-                            self.map[x].append(block)
+                    values = "".join(data[:self.size * self.size]).encode()
+                    if len(values) == self.size * self.size and len(values.translate(None, b"01")) == 0:
+                        values = values.translate(Map.VALUES)
+                        for x in range(0, self.size):
+                            offset = (x + 1) * self.width + 1
+                            self.cells[offset:offset + self.size] = values[x * self.size:(x + 1) * self.size]
+                    else:
+                        for x in range(0, self.size):
+                            offset = (x + 1) * self.width + 1
+                            for y in range(0, self.size):
+                                block = int(data[x * self.size + y])
+                                if block < 0 or block > 1:
+                                    raise Exception(
+                                        "Value in map must be either 0 or 1")
+                                self.cells[offset + y] = block
+                    # Optional cost layer: "costs", then a cost per block row after row
+                    data = data[self.size * self.size:]
+                    if len(data) > 0 and data[0] == Map.COSTS_TOKEN:
+                        self.use_costs([int(cost) for cost in data[1:1 + self.size * self.size]])
+                    self.changed()
                 except IOError:
                     print("Something went wrong while reading from {}".format(file_name))
                 finally:
@@ -49,18 +225,56 @@ class Map:
         except FileNotFoundError:
             return False
 
+    def read_binary(self, file_name):
+        # Map the file copy-on-write: nothing is read up front and wall edits
+        # stay in memory instead of reaching the file
+        try:
+            with open(file_name, "rb") as file:
+                self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except FileNotFoundError:
+            return False
+        magic, size, start_x, start_y, end_x, end_y = Map.HEADER.unpack_from(self.mapping)
+        if magic != Map.MAGIC or len(self.mapping) < Map.HEADER.size + (size + 2) * (size + 2):
+            raise Exception("{} is not a valid binary map".format(file_name))
+        end = Map.HEADER.size + (size + 2) * (size + 2)
+        self.use_buffer(memoryview(self.mapping)[Map.HEADER.size:end], size)
+        offset = Map.costs_offset(end)
+        if len(self.mapping) >= offset + Map.COSTS_HEADER.size:
+            magic, item_size = Map.COSTS_HEADER.unpack_from(self.mapping, offset)
+            start = offset + Map.COSTS_HEADER.size
+            if magic != Map.COSTS_MAGIC or item_size not in (1, 2) or \
+                    len(self.mapping) < start + item_size * len(self.cells):
+                raise Exception("{} has an invalid cost layer".format(file_name))
+            costs = memoryview(self.mapping)[start:start + item_size * len(self.cells)]
+            typecode = "B" if item_size == 1 else "H"
+            if item_size == 1 or sys.byteorder == "little":
+                self.costs = costs.cast(typecode)
+            else:
+                self.costs = array.array(typecode, costs)
+                self.costs.byteswap()
+            self.changed()
+        self.start.x = start_x
+        self.start.y = start_y
+        self.end.x = end_x
+        self.end.y = end_y
+        return True
+
     def save_to_file(self, file_name):
         try:
             with open(file_name, "w") as file:
                 try:
-                    data = "{}\n".format(self.size)
-                    data += "{} {}\n{} {}\n".format(self.start.x,
-                                                    self.start.y, self.end.x, self.end.y)
-                    for row in range(self.size):
-                        for col in range(self.size):
-                            data += "{} ".format(self.map[row][col])
-                        data += "\n"
-                    file.write(data)
+                    file.write("{}\n".format(self.size))
+                    file.write("{} {}\n{} {}\n".format(self.start.x,
+                                                       self.start.y, self.end.x, self.end.y))
+                    for x in range(self.size):
+                        offset = (x + 1) * self.width + 1
+                        row = bytes(self.cells[offset:offset + self.size]).translate(Map.DIGITS).decode()
+                        file.write(" ".join(row) + " \n")
+                    if self.costs != None:
+                        file.write(Map.COSTS_TOKEN + "\n")
+                        for x in range(self.size):
+                            offset = (x + 1) * self.width + 1
+                            file.write(" ".join(str(cost) for cost in self.costs[offset:offset + self.size]) + " \n")
                 except IOError:
                     print("Something went wrong while writing to {}".format(file_name))
                 finally:
@@ -69,6 +283,24 @@ class Map:
         except:
             return False
 
+    def save_binary(self, file_name):
+        try:
+            with open(file_name, "wb") as file:
+                file.write(Map.HEADER.pack(Map.MAGIC, self.size, self.start.x, self.start.y, self.end.x, self.end.y))
+                file.write(self.cells)
+                if self.costs != None:
+                    end = Map.HEADER.size + len(self.cells)
+                    file.write(bytes(Map.costs_offset(end) - end))
+                    costs = array.array(self.costs.format if isinstance(self.costs, memoryview)
+                                        else self.costs.typecode, self.costs)
+                    file.write(Map.COSTS_HEADER.pack(Map.COSTS_MAGIC, costs.itemsize))
+                    if sys.byteorder != "little":
+                        costs.byteswap()
+                    file.write(costs.tobytes())
+            return True
+        except:
+            return False
+
     def print_map(self):
         for x in range(0, self.size):
             print(self.map[x])
@@ -87,4 +319,46 @@ class Map:
         return x >= 0 and x < self.size and y >= 0 and y < self.size
 
     def is_wall(self, x, y):
-        return self.map[x][y] == 1
+        return self.cells[(x + 1) * self.width + y + 1] == Map.WALL
+
+    def cell_id(self, x, y):
+        return (x + 1) * self.width + y + 1
+
+    def position(self, cell):
+        return Position(cell // self.width - 1, cell % self.width - 1)
+
+    def neighbor_offsets(self):
+        # Same order as the (dx, dy) moves used by the searches
+        width = self.width
+        return [-width - 1, -width, -width + 1, 1, width + 1, width, width - 1, -1]
+
+    def changed_positions(self, other):
+        # Positions whose block differs from the same size map other, e.g. two
+        # Grid.save_map snapshots. Whole rows are compared first.
+        positions = []
+        for x in range(self.size):
+            offset = (x + 1) * self.width + 1
+            row = self.cells[offset:offset + self.size]
+            other_row = other.cells[offset:offset + self.size]
+            if row != other_row:
+                positions.extend((x, y) for y in range(self.size) if row[y] != other_row[y])
+        return positions
+
+    def new_buffer(self, default_value):
+        # A flat per-cell buffer (g-scores, parents, ...) matching the cell ids
+        return [default_value] * len(self.cells)
+
+
+if __name__ == "__main__":
+    # Convert a map file to the other format: search_map.py input output
+    if len(sys.argv) != 3:
+        raise Exception("""This program needs 2 arguments for input path and output path""")
+    map = Map()
+    if not map.read_from_file(sys.argv[1]):
+        raise Exception("Cannot read map from {}".format(sys.argv[1]))
+    with open(sys.argv[1], "rb") as file:
+        binary = file.read(len(Map.MAGIC)) == Map.MAGIC
+    if binary:
+        map.save_to_file(sys.argv[2])
+    else:
+        map.save_binary(sys.argv[2])
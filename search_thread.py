@@ -3,13 +3,20 @@ import math
 import heuristic
 import astar
 import ara
+import jps
+import bidirectional
 
 class AStarThread(threading.Thread):
+    # Search engine run by the thread, any class with AStar's search_map.
+    # message_queue may be a configured message.EventQueue (batching, sampling).
+    engine = astar.AStar
+
     def __init__(self, map=None, heuristic=heuristic.Heuristic.max_dx_dy, epsilon=1.0, message_queue=None):
         threading.Thread.__init__(self)
         self.started = False
         self.finished = False
         self.result = None
+        self.stats = None
         self.map = map
         self.heuristic = heuristic
         self.epsilon = epsilon
@@ -20,10 +27,17 @@ class AStarThread(threading.Thread):
         if self.map == None:
             self.finished = True
             return
-        raw_res = astar.AStar.search_map(self.map, self.heuristic, self.epsilon, self.message_queue)
+        raw_res = self.engine.search_map(self.map, self.heuristic, self.epsilon, self.message_queue)
+        self.stats = raw_res.stats
         self.result = astar.AStar.parse_result(*raw_res, message_queue=self.message_queue)
         self.finished = True
 
+class JPSThread(AStarThread):
+    engine = jps.JPS
+
+class BidirectionalThread(AStarThread):
+    engine = bidirectional.BidirectionalAStar
+
 class ARAThread(threading.Thread):
     def __init__(self, map=None, heuristic=heuristic.Heuristic.max_dx_dy, limit=math.inf, epsilon=5.0, message_queue=None):
         threading.Thread.__init__(self)
@@ -0,0 +1,46 @@
+import random
+import unittest
+import search_map
+import components
+
+class TestComponentIndex(unittest.TestCase):
+    def test_batched_walls_split(self):
+        map = search_map.Map()
+        map.map = [[0, 0, 0, 0, 0], [0, 1, 1, 0, 0]] + [[1, 1, 1, 1, 1]] * 3
+        index = components.ComponentIndex(map)
+        self.assertTrue(index.connected(search_map.Position(0, 0), search_map.Position(0, 3)))
+        map.map[0][1] = 1
+        map.map[0][2] = 1
+        index.update([(0, 1), (0, 2)])
+        self.assertFalse(index.connected(search_map.Position(0, 0), search_map.Position(0, 3)))
+
+    def test_batched_updates_match_rebuild(self):
+        generator = random.Random(0)
+        size = 12
+        for _ in range(50):
+            map = search_map.Map()
+            map.map = [[1 if generator.random() < 0.3 else 0 for _ in range(size)] for _ in range(size)]
+            index = components.ComponentIndex(map)
+            positions = [search_map.Position(x, y) for x in range(size) for y in range(size)]
+            for _ in range(10):
+                edits = [(generator.randrange(size), generator.randrange(size)) for _ in range(generator.randint(1, 3))]
+                for x, y in edits:
+                    map.map[x][y] = 1 - map.map[x][y]
+                index.update(edits)
+                fresh = components.ComponentIndex(map)
+                for _ in range(100):
+                    start = generator.choice(positions)
+                    end = generator.choice(positions)
+                    self.assertEqual(index.connected(start, end), fresh.connected(start, end))
+
+    def test_edit_without_update_rebuilds(self):
+        map = search_map.Map()
+        map.map = [[0, 1, 0], [0, 1, 0], [0, 1, 0]]
+        index = components.ComponentIndex(map)
+        self.assertFalse(index.connected(search_map.Position(0, 0), search_map.Position(0, 2)))
+        map.map[1][1] = 0
+        self.assertTrue(index.connected(search_map.Position(0, 0), search_map.Position(0, 2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import array
+import search_map
+import utilities
+import astar
+
+class GoalTree:
+    # Shortest path tree rooted at a goal, built with one backward search over
+    # the whole map (a breadth-first search is Dijkstra for the unit moves of
+    # the searches). Any start is then answered by following next_cells, in
+    # time proportional to the path length.
+    def __init__(self, map, goal):
+        if map.costs != None:
+            raise Exception("Shortest path trees need a map without block costs")
+        self.map = map
+        self.goal = (goal.x, goal.y)
+        self.version = map.version
+        count = len(map.cells)
+        # Distance to the goal and next block towards it, -1 when unreachable
+        self.distances = array.array("i", [-1]) * count
+        self.next_cells = array.array("i", [-1]) * count
+        self.build()
+
+    def build(self):
+        map = self.map
+        if not map.is_valid(*self.goal) or map.is_wall(*self.goal):
+            return
+        cells = map.cells
+        wall = search_map.Map.WALL
+        offsets = map.neighbor_offsets()
+        distances = self.distances
+        next_cells = self.next_cells
+        goal_cell = map.cell_id(*self.goal)
+        distances[goal_cell] = 0
+        frontier = [goal_cell]
+        distance = 0
+        while frontier:
+            distance += 1
+            next_frontier = []
+            for cell in frontier:
+                for offset in offsets:
+                    child = cell + offset
+                    if cells[child] == wall or distances[child] != -1:
+                        continue
+                    distances[child] = distance
+                    next_cells[child] = cell
+                    next_frontier.append(child)
+            frontier = next_frontier
+
+    def memory(self):
+        # Bytes held by the arrays
+        return (len(self.distances) + len(self.next_cells)) * self.distances.itemsize
+
+    def path(self, start):
+        # Cells from start to the goal, empty when the goal cannot be reached
+        map = self.map
+        if not map.is_valid(start.x, start.y):
+            return []
+        cell = map.cell_id(start.x, start.y)
+        if self.distances[cell] == -1:
+            return []
+        path = [cell]
+        next_cells = self.next_cells
+        while next_cells[cell] != -1:
+            cell = next_cells[cell]
+            path.append(cell)
+        return path
+
+    def search(self, start):
+        # Same result as a search from start to the goal of the tree
+        path = self.path(start)
+        stats = utilities.SearchStats()
+        if len(path) > 0:
+            stats.path_cost = len(path) - 1
+        return astar.SearchResult(self.map, path, len(path) > 0, stats, False)
+
+
+class GoalTreeStore:
+    # Decides which goals get a GoalTree. A goal earns one after min_queries
+    # queries, and trees are kept within memory_budget bytes by dropping the
+    # trees of the least queried goals, as long as they are queried less than
+    # the new goal. Trees built on an older map version are dropped on use.
+    def __init__(self, map, memory_budget=64 * 1024 * 1024, min_queries=8):
+        self.map = map
+        self.memory_budget = memory_budget
+        self.min_queries = min_queries
+        self.counts = {}
+        self.trees = {}
+        self.memory = 0
+
+    def drop(self, goal):
+        tree = self.trees.pop(goal)
+        self.memory -= tree.memory()
+
+    def tree(self, goal):
+        # Count a query to goal (an (x, y) pair) and return its tree, None if the
+        # goal has none
+        count = self.counts.get(goal, 0) + 1
+        self.counts[goal] = count
+        tree = self.trees.get(goal)
+        if tree != None and tree.version != self.map.version:
+            self.drop(goal)
+            tree = None
+        if tree != None or count < self.min_queries:
+            return tree
+
+        # Every tree of a map has the same size
+        needed = 8 * len(self.map.cells)
+        if needed > self.memory_budget:
+            return None
+        victims = []
+        memory = self.memory
+        for other in sorted(self.trees, key=lambda other: self.counts[other]):
+            if memory + needed <= self.memory_budget:
+                break
+            if self.counts[other] >= count:
+                return None
+            victims.append(other)
+            memory -= self.trees[other].memory()
+        if memory + needed > self.memory_budget:
+            return None
+        for other in victims:
+            self.drop(other)
+        tree = GoalTree(self.map, search_map.Position(goal[0], goal[1]))
+        self.trees[goal] = tree
+        self.memory += tree.memory()
+        return tree
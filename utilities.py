@@ -1,54 +1,124 @@
 import os
 import time
 import search_map 
-import grid
 import functools 
+import threading
+import collections
 
 class Utilities:
-    @staticmethod
-    def create_grid(row_num, col_num, default_value):
-        a_grid = []
-        for row in range(0, row_num):
-            a_row = []
-            for col in range(0, col_num):
-                item = grid.GridItem()
-                item.push(default_value)
-                a_row.append(item)
-            a_grid.append(a_row)
-        return a_grid
-    
     @staticmethod
     def create_map(size, default_value):
-        matrix = []
-        for row in range(size):
-            a_row = []
-            for col in range(size):
-                a_row.append(default_value)
-            matrix.append(a_row)
         map = search_map.Map()
-        map.map = matrix
-        map.size = size
+        map.resize(size, default_value)
         return map
 
+class SearchStats:
+    # Per-call statistics returned with every search result
+    def __init__(self, expanded=0, pushes=0, duplicate_pops=0, peak_open=0, path_cost=-1):
+        self.wall_time = 0.0
+        self.expanded = expanded
+        self.pushes = pushes
+        self.duplicate_pops = duplicate_pops
+        self.peak_open = peak_open
+        self.path_cost = path_cost
+
+    def as_dict(self):
+        return dict(
+            wall_time=self.wall_time,
+            expanded=self.expanded,
+            pushes=self.pushes,
+            duplicate_pops=self.duplicate_pops,
+            peak_open=self.peak_open,
+            path_cost=self.path_cost,
+        )
+
+
+class Metrics:
+    # Hooks are called as hook(name, stats) after every timed call, and with the
+    # CacheStats of a cache after every lookup in it
+    hooks = ()
+    lock = threading.Lock()
+    # Print timings, off by default so the search path does no stdout I/O
+    verbose = False
+
+    @staticmethod
+    def add_hook(hook):
+        with Metrics.lock:
+            Metrics.hooks = Metrics.hooks + (hook,)
+
+    @staticmethod
+    def remove_hook(hook):
+        with Metrics.lock:
+            Metrics.hooks = tuple(h for h in Metrics.hooks if h != hook)
+
     @staticmethod
-    def create_matrix(size, default_value):
-        matrix = []
-        for row in range(size):
-            a_row = []
-            for col in range(size):
-                a_row.append(default_value)
-            matrix.append(a_row)
-        return matrix
+    def publish(name, stats):
+        for hook in Metrics.hooks:
+            hook(name, stats)
+
+
+class MapCache:
+    # Data derived from a map (jump tables, cluster graphs, ...) made by
+    # build(map), kept for the last capacity maps and built again once the map
+    # version changes. Entries hold their map, so map ids are never reused.
+    def __init__(self, build, capacity=4):
+        self.build = build
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, map):
+        key = id(map)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None and entry[1] == map.version:
+                self.entries.move_to_end(key)
+                return entry[2]
+        version = map.version
+        data = self.build(map)
+        with self.lock:
+            self.entries[key] = (map, version, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return data
+
+
+class CacheStats:
+    # Counters of a result cache, published to Metrics on every lookup
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.size = 0
+
+    def as_dict(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+            size=self.size,
+        )
+
 
 def timer(func):
+    # Time each call separately and store it on the result's stats, so concurrent
+    # searches never share a timing
     @functools.wraps(func)
     def timed(*args, **kwargs):
         time_start = time.perf_counter()
         result = func(*args, **kwargs)
         time_end = time.perf_counter()
 
-        timed.time_elapsed = float(time_end - time_start) * 1000
-        print("{} runs in  {:.2f} milliseconds".format(func.__name__, timed.time_elapsed))
-        
+        stats = getattr(result, "stats", None)
+        if stats == None:
+            stats = SearchStats()
+        stats.wall_time = float(time_end - time_start) * 1000
+        Metrics.publish(func.__qualname__, stats)
+        if Metrics.verbose:
+            print("{} runs in  {:.2f} milliseconds".format(func.__qualname__, stats.wall_time))
+
         return result
     return timed
\ No newline at end of file
@@ -0,0 +1,168 @@
+import time
+import utilities
+import grid
+import message
+import search_map
+import heuristic as heuristics
+import queues
+import astar
+
+class WeightedAStar:
+    # A* over block costs (Map.costs) with sqrt(2) diagonal moves. Moves cost an
+    # integer: STRAIGHT or DIAGONAL times the cost of the entered block, with
+    # DIAGONAL / STRAIGHT = 1.41429, within 0.01% of sqrt(2). Integer f values
+    # of a consistent heuristic never decrease, so they go in a radix queue.
+    # Path costs are reported in straight moves over cost 1 blocks.
+    CHECK_EVERY = 256
+    # Searches Map.costs, engines without it search unit costs
+    USES_COSTS = True
+    STRAIGHT = 70
+    DIAGONAL = 99
+
+    @staticmethod
+    def move_costs():
+        # Cost factor of each move of map.neighbor_offsets()
+        straight = WeightedAStar.STRAIGHT
+        diagonal = WeightedAStar.DIAGONAL
+        return [diagonal, straight, diagonal, straight, diagonal, straight, diagonal, straight]
+
+    @staticmethod
+    def scaled_heuristic(map, heuristic, end):
+        # Integer heuristic of a cell towards end in move cost units. The octile
+        # and max(dx, dy) distances become the exact octile distance with these
+        # moves over the cheapest block. Other heuristics, which bound the unit
+        # move distance, are scaled by STRAIGHT times the cheapest block and
+        # rounded down, so admissible and consistent ones stay so.
+        width = map.width
+        scale = map.min_cost()
+        if heuristic == heuristics.Heuristic.octile_distance or heuristic == heuristics.Heuristic.max_dx_dy:
+            straight = WeightedAStar.STRAIGHT * scale
+            extra = (WeightedAStar.DIAGONAL - WeightedAStar.STRAIGHT) * scale
+            end_x = end.x + 1
+            end_y = end.y + 1
+
+            def octile(cell):
+                dx = abs(cell // width - end_x)
+                dy = abs(cell % width - end_y)
+                if dx < dy:
+                    return straight * dy + extra * dx
+                return straight * dx + extra * dy
+            return octile
+
+        scale *= WeightedAStar.STRAIGHT
+        field = None
+        if hasattr(heuristic, "lookup"):
+            field = heuristic.lookup(map, end)
+        if field != None:
+            return lambda cell: int(field[cell] * scale)
+        probe = search_map.Position()
+
+        def scaled(cell):
+            probe.x = cell // width - 1
+            probe.y = cell % width - 1
+            return int(heuristic(probe, end) * scale)
+        return scaled
+
+    @staticmethod
+    @utilities.timer
+    def search_map(map, heuristic, epsilon=1, message_queue=None, deadline=None, buffers=None):
+        # Same arguments and result as AStar.search_map, epsilon above 1 inflates
+        # the heuristic and uses a binary heap instead of the radix queue
+        cells = map.cells
+        width = map.width
+        wall = search_map.Map.WALL
+        costs = map.costs
+        if costs == None:
+            costs = bytes([1]) * len(cells)
+        moves = list(zip(map.neighbor_offsets(), WeightedAStar.move_costs()))
+        if buffers == None or not buffers.fits(map):
+            buffers = astar.SearchBuffers(map)
+        generation = buffers.next_generation()
+        seen = generation * 2
+        closed = seen + 1
+        stamps = buffers.stamps
+        g_values = buffers.g_values
+        parents = buffers.parents
+        start_cell = map.cell_id(map.start.x, map.start.y)
+        end_cell = map.cell_id(map.end.x, map.end.y)
+        if not map.is_valid(map.end.x, map.end.y):
+            end_cell = -1
+        h = WeightedAStar.scaled_heuristic(map, heuristic, map.end)
+
+        path_found = False
+        path = []
+        expanded = 0
+        pushes = 0
+        duplicate_pops = 0
+        peak_open = 0
+        timed_out = False
+        check_every = WeightedAStar.CHECK_EVERY
+        # Entries are (f, cell), older entries of a block come out after the best one
+        if epsilon == 1:
+            # 1.0 as an int, so the radix queue gets integer keys
+            epsilon = int(epsilon)
+            queue = queues.RadixQueue()
+        else:
+            queue = queues.HeapQueue()
+        push = queue.push
+        pop = queue.pop
+        size = queue.size
+        events = message.EventQueue.wrap(message_queue, width)
+        if events != None:
+            events.put_nowait(message.Message(action="LOCK"))
+            events.put_nowait(message.Message(action="CLEAR"))
+        if map.is_valid(map.start.x, map.start.y) and not map.is_wall(map.start.x, map.start.y):
+            stamps[start_cell] = seen
+            g_values[start_cell] = 0
+            parents[start_cell] = -1
+            push((h(start_cell) * epsilon, start_cell))
+            pushes += 1
+            peak_open = 1
+        while size() > 0:
+            _, cell = pop()
+            if stamps[cell] == closed:
+                duplicate_pops += 1
+                continue
+            stamps[cell] = closed
+            expanded += 1
+            if deadline != None and expanded % check_every == 0 and time.perf_counter() >= deadline:
+                timed_out = True
+                break
+
+            if events != None:
+                events.push(cell, grid.Grid.POP_ID)
+
+            if cell == end_cell:
+                path_found = True
+                break
+
+            g_cell = g_values[cell]
+            for offset, move_cost in moves:
+                child = cell + offset
+                if cells[child] == wall:
+                    continue
+                stamp = stamps[child]
+                if stamp == closed:
+                    continue
+                g_value = g_cell + move_cost * costs[child]
+                if stamp == seen and g_values[child] <= g_value:
+                    continue
+
+                stamps[child] = seen
+                g_values[child] = g_value
+                parents[child] = cell
+                push((g_value + h(child) * epsilon, child))
+                pushes += 1
+                if size() > peak_open:
+                    peak_open = size()
+
+                if events != None:
+                    events.push(child, grid.Grid.IN_QUEUE_ID)
+
+        if events != None:
+            events.flush()
+        stats = utilities.SearchStats(expanded, pushes, duplicate_pops, peak_open)
+        if path_found:
+            path = astar.AStar.build_path(parents, end_cell)
+            stats.path_cost = g_values[end_cell] / WeightedAStar.STRAIGHT
+        return astar.SearchResult(map, path, path_found, stats, timed_out)